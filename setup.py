@@ -31,6 +31,11 @@ install_requires = [
     'psycopg2'
 ]
 
+extras_require = {
+    # AsyncAlchemyAccountStore
+    'async': ['sqlalchemy>=1.4'],
+}
+
 setup(
     name='yosai_alchemystore',
     use_scm_version={
@@ -45,8 +50,9 @@ setup(
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         'Topic :: Security',
         'Topic :: Software Development :: Libraries :: Application Frameworks',
         'Topic :: Software Development :: Libraries :: Python Modules',
@@ -60,7 +66,9 @@ setup(
     setup_requires=[
         'setuptools_scm >= 1.7.0'
     ],
+    python_requires='>=3.7',
     install_requires=install_requires,
+    extras_require=extras_require,
     zip_safe=False,
     cmdclass={'clean': CleanCommand}
 )
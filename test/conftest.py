@@ -0,0 +1,159 @@
+import datetime
+import json
+
+import pytest
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    Base,
+    init_session,
+)
+
+from yosai_alchemystore.models.models import (
+    Action,
+    Credential,
+    CredentialType,
+    Domain,
+    Permission,
+    Resource,
+    Role,
+    User,
+)
+
+
+def create_engine(db_url='sqlite://'):
+    if db_url == 'sqlite://':
+        # a single shared connection, or every session would see its own database
+        return sqlalchemy.create_engine(db_url, poolclass=StaticPool,
+                                        connect_args={'check_same_thread': False})
+    return sqlalchemy.create_engine(db_url)
+
+
+def populate(Session):
+    """
+    thedude:  bankcustomer, courier, tenant (password and totp_key)
+    walter:   bankcustomer, courier (password)
+    marty:    bankcustomer, landlord (password)
+    nocreds:  no roles or credentials
+    """
+    session = Session()
+
+    users = {identifier: User(first_name=first_name, last_name=last_name,
+                              identifier=identifier, phone_number=phone_number)
+             for identifier, first_name, last_name, phone_number in [
+                 ('thedude', 'Jeffrey', 'Lebowski', '11234567890'),
+                 ('walter', 'Walter', 'Sobchak', None),
+                 ('marty', 'Marty', 'Houston', None),
+                 ('nocreds', 'No', 'Creds', None)]}
+    domains = {name: Domain(name=name) for name in ['money', 'leatherduffelbag']}
+    actions = {name: Action(name=name)
+               for name in ['write', 'deposit', 'transport', 'access', 'withdrawal',
+                            'bowl', 'run']}
+    resources = {name: Resource(name=name)
+                 for name in ['theringer', 'ransom', 'bankcheck_19911109069']}
+    roles = {title: Role(title=title)
+             for title in ['courier', 'tenant', 'landlord', 'bankcustomer']}
+    credential_types = {title: CredentialType(title=title)
+                        for title in ['password', 'totp_key']}
+
+    session.add_all(list(users.values()) + list(domains.values()) +
+                    list(actions.values()) + list(resources.values()) +
+                    list(roles.values()) + list(credential_types.values()))
+    session.flush()
+
+    expiration_dt = datetime.datetime.now() + datetime.timedelta(days=30)
+    for identifier in ['thedude', 'walter', 'marty']:
+        session.add(Credential(user_id=users[identifier].pk_id,
+                               credential='pw-' + identifier,
+                               credential_type_id=credential_types['password'].pk_id,
+                               expiration_dt=expiration_dt))
+    session.add(Credential(user_id=users['thedude'].pk_id,
+                           credential='totp',
+                           credential_type_id=credential_types['totp_key'].pk_id,
+                           expiration_dt=expiration_dt))
+
+    write_check = Permission(domain=domains['money'], action=actions['write'],
+                             resource=resources['bankcheck_19911109069'])
+    deposit = Permission(domain=domains['money'], action=actions['deposit'])
+    transport = Permission(domain=domains['leatherduffelbag'], action=actions['transport'],
+                           resource=resources['theringer'])
+    access = Permission(domain=domains['leatherduffelbag'], action=actions['access'],
+                        resource=resources['theringer'])
+    withdrawal = Permission(domain=domains['money'], action=actions['withdrawal'])
+    bowl = Permission(action=actions['bowl'])
+    run = Permission(action=actions['run'])
+    session.add_all([write_check, deposit, transport, access, withdrawal, bowl, run])
+
+    roles['bankcustomer'].permissions.extend([deposit, bowl, run])
+    roles['courier'].permissions.extend([transport, access, bowl, run])
+    roles['tenant'].permissions.extend([write_check, bowl, run])
+    roles['landlord'].permissions.extend([withdrawal, bowl, run])
+
+    users['thedude'].roles.extend([roles['bankcustomer'], roles['courier'], roles['tenant']])
+    users['walter'].roles.extend([roles['bankcustomer'], roles['courier']])
+    users['marty'].roles.extend([roles['bankcustomer'], roles['landlord']])
+
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine()
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def Session(engine):
+    Session = init_session(engine=engine)
+    populate(Session)
+    return Session
+
+
+@pytest.fixture
+def account_store(Session):
+    return AlchemyAccountStore(session=Session)
+
+
+def _permission_parts(permissions):
+    result = {}
+    for domain, parts in permissions.items():
+        if isinstance(parts, str):
+            parts = [(part['domain'], frozenset(part['action']), frozenset(part['resource']))
+                     for part in json.loads(parts)]
+        else:
+            parts = [(part.domain, part.action, part.resource) for part in parts]
+        result[domain] = set(parts)
+    return result
+
+
+@pytest.fixture
+def permission_parts():
+    """
+    :returns: a callable that normalizes the permissions of
+              get_authz_permissions to a dict of domain to a set of
+              (domain, actions, resources) tuples, whatever the
+              permission_format
+    """
+    return _permission_parts
+
+
+class FakeTimer:
+    """
+    A monotonic clock that only advances when now is set
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
@@ -0,0 +1,270 @@
+import functools
+
+import pytest
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects import postgresql
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    PermissionInterner,
+    PermissionParts,
+)
+from yosai_alchemystore.accountstore.accountstore import as_row
+from yosai_alchemystore.models.models import User
+
+# store configurations whose read paths run on sqlite, as keyword arguments
+CONFIGURATIONS = {
+    'baked': {},
+    'unbaked': dict(bake_queries=False),
+    'flat': dict(permission_strategy='flat'),
+    'effective': dict(effective_permissions=True),
+    'core': dict(core_reads=True),
+    'compact': dict(permission_format='compact'),
+}
+
+THEDUDE_PERMISSIONS = {
+    '*': {('*', frozenset(['bowl', 'run']), frozenset(['*']))},
+    'leatherduffelbag': {('leatherduffelbag', frozenset(['transport', 'access']),
+                          frozenset(['theringer']))},
+    'money': {('money', frozenset(['deposit']), frozenset(['*'])),
+              ('money', frozenset(['write']), frozenset(['bankcheck_19911109069']))},
+}
+
+
+@pytest.fixture(params=sorted(CONFIGURATIONS))
+def configured_store(request, Session):
+    store = AlchemyAccountStore(session=Session, **CONFIGURATIONS[request.param])
+    if store.effective_permissions:
+        store.refresh_effective_permissions()
+    return store
+
+
+def test_get_authc_info(configured_store):
+    authc_info = configured_store.get_authc_info('thedude')
+
+    assert authc_info['account_locked'] is None
+    assert authc_info['authc_info']['password']['credential'] == 'pw-thedude'
+    assert authc_info['authc_info']['totp_key']['2fa_info'] == {'phone_number': '11234567890'}
+
+
+def test_get_authc_info_unknown(configured_store):
+    assert configured_store.get_authc_info('nocreds') is None
+    assert configured_store.get_authc_info('ghost') is None
+
+
+def test_get_authc_info_locked(account_store):
+    account_store.lock_account('walter', 1472000000000)
+    assert account_store.get_authc_info('walter')['account_locked'] == 1472000000000
+
+    account_store.unlock_account('walter')
+    assert account_store.get_authc_info('walter') == {
+        'account_locked': None,
+        'authc_info': {'password': {'credential': 'pw-walter', 'failed_attempts': []}}}
+
+
+def test_get_authz_permissions(configured_store, permission_parts):
+    permissions = configured_store.get_authz_permissions('thedude')
+    assert permission_parts(permissions) == THEDUDE_PERMISSIONS
+    assert configured_store.get_authz_permissions('ghost') == {}
+
+
+def test_get_authz_roles(configured_store):
+    assert sorted(configured_store.get_authz_roles('thedude')) == [
+        'bankcustomer', 'courier', 'tenant']
+    assert configured_store.get_authz_roles('ghost') == []
+
+
+def test_multi_lookups_match_single(configured_store, permission_parts):
+    configured_store.multi_chunk_size = 2
+    identifier_s = ['thedude', 'walter', 'marty', 'nocreds', 'ghost', 'walter']
+
+    authc_info = configured_store.get_authc_info_multi(identifier_s)
+    permissions = configured_store.get_authz_permissions_multi(identifier_s)
+    roles = configured_store.get_authz_roles_multi(identifier_s)
+
+    for identifier in set(identifier_s):
+        assert authc_info[identifier] == configured_store.get_authc_info(identifier)
+        assert (permission_parts(permissions[identifier]) ==
+                permission_parts(configured_store.get_authz_permissions(identifier)))
+        assert sorted(roles[identifier]) == sorted(configured_store.get_authz_roles(identifier))
+
+
+def test_get_account(configured_store, permission_parts):
+    account = configured_store.get_account('thedude')
+
+    assert account['account_id'] == 'thedude'
+    assert account['authc_info'] == configured_store.get_authc_info('thedude')['authc_info']
+    assert sorted(account['authz_info']['roles']) == ['bankcustomer', 'courier', 'tenant']
+    assert permission_parts(account['authz_info']['permissions']) == THEDUDE_PERMISSIONS
+    assert configured_store.get_account('ghost') is None
+
+
+def test_get_account_is_a_single_statement(Session, monkeypatch):
+    store = AlchemyAccountStore(session=Session, permission_strategy='aggregate')
+    monkeypatch.setattr(store, '_aggregates_permissions', lambda session: True)
+    session = store.Session()
+    try:
+        query = store._get_account_query(session, 'thedude')
+        sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    finally:
+        session.close()
+
+    assert sql.count('UNION ALL') == 3
+    assert 'json_agg' in sql
+
+
+@pytest.mark.parametrize('bake_queries, builds', [(True, 1), (False, 3)])
+def test_baked_queries_are_built_once(Session, monkeypatch, bake_queries, builds):
+    store = AlchemyAccountStore(session=Session, bake_queries=bake_queries)
+    calls = []
+    builder = store._get_roles_query
+
+    @functools.wraps(builder)
+    def counting_builder(session, identifier):
+        calls.append(identifier)
+        return builder(session, identifier)
+
+    monkeypatch.setattr(store, '_get_roles_query', counting_builder)
+
+    for identifier in ['thedude', 'walter', 'thedude']:
+        assert store.get_authz_roles(identifier) == AlchemyAccountStore(
+            session=Session).get_authz_roles(identifier)
+    assert len(calls) == builds
+
+
+def test_compact_permissions_are_interned(Session):
+    interner = PermissionInterner()
+    store = AlchemyAccountStore(session=Session, permission_format='compact',
+                                interner=interner)
+
+    dude = store.get_authz_permissions('thedude')
+    walter = store.get_authz_permissions('walter')
+
+    assert all(isinstance(parts, PermissionParts) for parts in dude['*'])
+    assert dude['*'][0] is walter['*'][0]
+    assert dude['*'][0] is interner.parts('*', ['run', 'bowl'], ['*'])
+    assert dude['*'][0].as_parts() == {'domain': '*', 'action': {'bowl', 'run'},
+                                       'target': {'*'}}
+
+
+def test_interner_from_json():
+    interner = PermissionInterner()
+    parts = interner.from_json('[{"domain": "money", "action": ["write"], "resource": ["*"]},'
+                               ' {"domain": "money", "action": ["deposit"], "resource": ["*"]}]')
+
+    assert parts == (PermissionParts('money', frozenset(['write']), frozenset(['*'])),
+                     PermissionParts('money', frozenset(['deposit']), frozenset(['*'])))
+    assert parts[0].resource is parts[1].resource
+    assert len(interner) == 2
+
+
+def test_core_reads_build_statements_once(Session):
+    store = AlchemyAccountStore(session=Session, core_reads=True)
+
+    with store.session_scope() as session:
+        for identifier in ['thedude', 'walter', 'marty']:
+            store.get_authz_roles(identifier)
+            store.get_authc_info(identifier)
+        # plain rows, rather than ORM objects held by the session
+        assert len(session.identity_map) == 0
+
+    assert sorted(name for name, _ in store._statements) == [
+        '_get_authc_query', '_get_roles_query']
+    assert store._compiled_cache
+
+
+def test_session_scope_shares_a_session(account_store):
+    with account_store.session_scope() as session:
+        assert account_store._obtain_session() == (session, False)
+        with account_store.session_scope() as nested:
+            assert nested is session
+        account_store.get_authz_roles('thedude')
+        account_store.get_authc_info('thedude')
+    assert account_store._obtain_session()[1] is True
+
+
+def test_session_scope_rolls_back(account_store):
+    with pytest.raises(RuntimeError):
+        with account_store.session_scope() as session:
+            account_store.lock_account('walter', 1472000000000)
+            session.execute('UPDATE user SET phone_number = 1')
+            raise RuntimeError
+    assert account_store.get_authc_info('walter')['account_locked'] == 1472000000000
+    assert account_store.get_authc_info('thedude')['authc_info']['totp_key']['2fa_info'] == {
+        'phone_number': '11234567890'}
+
+
+def test_permissions_from_aggregate_core_rows(account_store, engine):
+    # core_reads yields a Core result, which has a keys() of its own
+    with engine.connect() as connection:
+        rows = connection.execute(select([literal('money').label('domain'),
+                                          literal('[]').label('parts')]))
+        assert account_store._permissions_from_aggregate(rows) == {'money': '[]'}
+
+
+def test_aggregate_queries_compile_for_postgresql(account_store, monkeypatch):
+    # get_account aggregates permissions only when the session is postgresql's
+    monkeypatch.setattr(account_store, '_aggregates_permissions', lambda session: True)
+    session = account_store.Session()
+    try:
+        for query in [account_store._get_permissions_query(session, 'thedude'),
+                      account_store._get_permissions_multi_query(session, ['thedude']),
+                      account_store._get_account_query(session, 'thedude')]:
+            sql = str(query.statement.compile(dialect=postgresql.dialect()))
+            assert 'json_agg' in sql
+    finally:
+        session.close()
+
+
+def test_as_row_is_cacheable():
+    def statement(column):
+        return select([func.row_to_json(as_row(select([column]).alias()))])
+
+    if not hasattr(statement(User.identifier), '_generate_cache_key'):
+        pytest.skip('SQLAlchemy < 1.4 has no statement cache')
+    key = statement(User.identifier)._generate_cache_key()
+    assert key is not None
+    assert key == statement(User.identifier)._generate_cache_key()
+    assert key != statement(User.first_name)._generate_cache_key()
+
+
+def test_statements_are_cacheable(Session, monkeypatch):
+    if not hasattr(select([literal(1)]), '_generate_cache_key'):
+        pytest.skip('SQLAlchemy < 1.4 has no statement cache')
+
+    store = AlchemyAccountStore(session=Session, core_reads=True)
+    with store.session_scope() as session:
+        store.get_authc_info('thedude')
+        store.get_authz_roles_multi(['thedude', 'walter'])
+        store.get_authz_permissions('thedude')
+        store.get_account('thedude')
+
+        monkeypatch.setattr(store, '_aggregates_permissions', lambda session: True)
+        statements = [store._get_permissions_query(session, 'thedude').statement,
+                      store._get_permissions_multi_query(session, ['thedude']).statement,
+                      store._get_account_query(session, 'thedude').statement]
+
+    assert len(store._statements) == 4
+    statements.extend(store._statements.values())
+    for statement in statements:
+        assert statement._generate_cache_key() is not None
+
+
+def test_aggregate_strategy_requires_postgresql(Session):
+    store = AlchemyAccountStore(session=Session, permission_strategy='aggregate')
+    with pytest.raises(ValueError):
+        store.get_authz_permissions('thedude')
+
+
+def test_invalid_arguments(Session):
+    with pytest.raises(ValueError):
+        AlchemyAccountStore(session=Session, permission_strategy='grouped')
+    with pytest.raises(ValueError):
+        AlchemyAccountStore(session=Session, permission_format='xml')
+
+
+def test_engine_is_created_on_first_use():
+    store = AlchemyAccountStore(db_url='sqlite://')
+    assert store._session is None
+    assert store.Session is store.Session
+    assert store.replicas is None
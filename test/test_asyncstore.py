@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    Base,
+    FailedAttemptBuffer,
+    init_session,
+)
+
+from conftest import create_engine, populate
+
+pytest.importorskip('sqlalchemy.ext.asyncio')
+pytest.importorskip('aiosqlite')
+
+from yosai_alchemystore import AsyncAlchemyAccountStore  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # a file, as the async engine doesn't share the sync engine's memory
+    path = str(tmp_path / 'accounts.db')
+    engine = create_engine('sqlite:///' + path)
+    Base.metadata.create_all(engine)
+    populate(init_session(engine=engine))
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def stores(db_path):
+    store = AlchemyAccountStore(db_url='sqlite:///' + db_path)
+    async_store = AsyncAlchemyAccountStore(db_url='sqlite+aiosqlite:///' + db_path,
+                                           track_versions=True)
+    yield store, async_store
+    store.Session.kw['bind'].dispose()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_reads_match_the_sync_store(stores, permission_parts):
+    store, async_store = stores
+
+    async def reads():
+        async with async_store.session_scope():
+            return (await async_store.get_authc_info('thedude'),
+                    await async_store.get_authz_permissions('thedude'),
+                    await async_store.get_authz_roles('thedude'),
+                    await async_store.get_authz_roles_multi(['thedude', 'marty']),
+                    await async_store.get_account('ghost'))
+
+    authc_info, permissions, roles, roles_multi, account = run(reads())
+    assert authc_info == store.get_authc_info('thedude')
+    assert permission_parts(permissions) == permission_parts(
+        store.get_authz_permissions('thedude'))
+    assert sorted(roles) == sorted(store.get_authz_roles('thedude'))
+    assert sorted(roles_multi['marty']) == ['bankcustomer', 'landlord']
+    assert account is None
+
+
+def test_lock_and_unlock_account(stores):
+    store, async_store = stores
+
+    run(async_store.lock_account('marty', 1472000000000))
+    assert store.get_authc_info('marty')['account_locked'] == 1472000000000
+
+    run(async_store.unlock_account('marty'))
+    assert store.get_authc_info('marty')['account_locked'] is None
+
+    run(async_store.lock_accounts((identifier for identifier in ['walter', 'marty']),
+                                  1472000000000))
+    assert store.is_account_locked('walter') is True
+    assert run(async_store.is_account_locked('marty')) is True
+
+
+def test_role_administration(stores):
+    store, async_store = stores
+
+    run(async_store.add_role_member('walter', 'tenant'))
+    assert 'tenant' in store.get_authz_roles('walter')
+    version, changes = run(async_store.get_authz_versions_since(0))
+    assert list(changes) == ['walter']
+
+    run(async_store.remove_role_member('walter', 'tenant'))
+    assert 'tenant' not in store.get_authz_roles('walter')
+
+
+def test_failed_attempts(db_path):
+    async_store = AsyncAlchemyAccountStore(
+        db_url='sqlite+aiosqlite:///' + db_path,
+        failed_attempts=FailedAttemptBuffer(flush_interval=3600))
+
+    async def failed_attempts():
+        await async_store.record_failed_attempt('thedude', attempt_millis=2000000000000)
+        await async_store.flush_failed_attempts()
+        await async_store.record_failed_attempt('walter', attempt_millis=2000000000001)
+        try:
+            return (await async_store.get_authc_info_multi(['thedude', 'walter']),
+                    await async_store.get_account('walter'))
+        finally:
+            await async_store.close()
+
+    authc_info, account = run(failed_attempts())
+    assert authc_info['thedude']['authc_info']['password']['failed_attempts'] == [
+        2000000000000]
+    assert authc_info['walter']['authc_info']['password']['failed_attempts'] == [
+        2000000000001]
+    assert account['authc_info'] == authc_info['walter']['authc_info']
+
+
+def test_failed_attempts_are_flushed_every_interval(db_path):
+    buffer = FailedAttemptBuffer(flush_interval=0.05)
+    async_store = AsyncAlchemyAccountStore(db_url='sqlite+aiosqlite:///' + db_path,
+                                           failed_attempts=buffer)
+
+    async def failed_attempts():
+        try:
+            async with async_store.session_scope():
+                await async_store.record_failed_attempt('thedude',
+                                                        attempt_millis=2000000000000)
+            for _ in range(100):
+                if not len(buffer):
+                    break
+                await asyncio.sleep(0.01)
+            return len(buffer), await async_store.get_authc_info('thedude')
+        finally:
+            await async_store.close()
+
+    pending, authc_info = run(failed_attempts())
+    assert pending == 0
+    assert authc_info['authc_info']['password']['failed_attempts'] == [2000000000000]
+    assert async_store._flush_task is None
+
+
+def test_iterators(stores):
+    store, async_store = stores
+
+    async def iterate():
+        identifier_s = [identifier async for identifier in
+                        async_store.iter_permitted_users('money', 'deposit', page_size=2)]
+        exported = [identifier async for identifier, _ in
+                    async_store.iter_authz_info(yield_per=1)]
+        return identifier_s, exported
+
+    identifier_s, exported = run(iterate())
+    assert identifier_s == list(store.iter_permitted_users('money', 'deposit'))
+    assert exported == [identifier for identifier, _ in store.iter_authz_info()]
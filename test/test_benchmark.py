@@ -0,0 +1,49 @@
+from yosai_alchemystore.benchmark import benchmark
+from yosai_alchemystore.benchmark.dataset import SyntheticDataset
+
+
+def rows(dataset):
+    # credentials expire relative to now
+    credentials = [dict(row, expiration_dt=None) for row in dataset.credential_rows()]
+    return (list(dataset.user_rows()), credentials,
+            list(dataset.role_membership_rows()), list(dataset.role_permission_rows()))
+
+
+def test_dataset_is_deterministic():
+    assert rows(SyntheticDataset(users=20, seed=1)) == rows(SyntheticDataset(users=20, seed=1))
+    assert rows(SyntheticDataset(users=20, seed=1)) != rows(SyntheticDataset(users=20, seed=2))
+
+    dataset = SyntheticDataset(users=20, roles=5, roles_per_user=3)
+    memberships = list(dataset.role_membership_rows())
+    assert len(memberships) == 60
+    assert len({(row['identifier'], row['role']) for row in memberships}) == 60
+
+
+def test_percentile():
+    samples = list(range(101))
+    assert benchmark.percentile(samples, 50) == 50
+    assert benchmark.percentile(samples, 99) == 99
+    assert benchmark.percentile([], 50) == 0.0
+
+
+def test_main(capsys):
+    benchmark.main(['--users', '20', '--roles', '5', '--permissions', '20',
+                    '--permissions-per-role', '5', '--calls', '10', '--batch-size', '5',
+                    '--config', 'default', '--config', 'aggregate'])
+
+    output = capsys.readouterr().out
+    for method_name in benchmark.METHODS:
+        assert 'default      ' + method_name in output
+    # aggregate is skipped on sqlite
+    assert 'aggregate' not in output
+
+
+def test_main_compare_indexes(capsys):
+    benchmark.main(['--users', '20', '--roles', '5', '--permissions', '20',
+                    '--permissions-per-role', '5', '--calls', '10', '--batch-size', '5',
+                    '--config', 'default', '--method', 'get_authz_roles',
+                    '--compare-indexes'])
+
+    output = capsys.readouterr().out
+    assert 'sqlite:// (without JOIN_INDEXES)' in output
+    assert output.count('default      get_authz_roles') == 2
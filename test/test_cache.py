@@ -0,0 +1,127 @@
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    CachingAccountStore,
+    LRUCache,
+)
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == (True, 1)
+
+    cache.set('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1) and cache.get('c') == (True, 3)
+    assert cache.stats == dict(hits=3, misses=1, evictions=1, size=2)
+
+
+def test_lru_cache_expires(timer):
+    cache = LRUCache(ttl=10, timer=timer)
+    cache.set('a', 1)
+
+    timer.now = 9.9
+    assert cache.get('a') == (True, 1)
+    timer.now = 10
+    assert cache.get('a') == (False, None)
+    assert len(cache) == 0
+
+
+def test_caching_account_store(Session):
+    store = CachingAccountStore(AlchemyAccountStore(session=Session))
+
+    roles = store.get_authz_roles('thedude')
+    assert store.get_authz_roles('thedude') is roles
+    assert store.get_authz_roles_multi(['thedude', 'walter'])['thedude'] is roles
+    permissions = store.get_authz_permissions('walter')
+    assert store.get_authz_permissions_multi(['walter'])['walter'] is permissions
+    assert store.stats['hits'] == 3
+
+    store.add_role_member('thedude', 'landlord')
+    assert 'landlord' in store.get_authz_roles('thedude')
+    store.grant_role_permission('courier', 1)
+    assert len(store.cache) == 0
+
+
+def test_reads_overlapping_an_invalidation_are_not_cached(Session, monkeypatch):
+    account_store = AlchemyAccountStore(session=Session)
+    store = CachingAccountStore(account_store)
+    get_authz_roles = account_store.get_authz_roles
+    get_authz_roles_multi = account_store.get_authz_roles_multi
+
+    def invalidating(read, identifier=None):
+        # a concurrent write invalidates while the read is in flight
+        def wrap(arg):
+            value = read(arg)
+            store.invalidate(identifier)
+            return value
+        return wrap
+
+    monkeypatch.setattr(account_store, 'get_authz_roles',
+                        invalidating(get_authz_roles, 'thedude'))
+    store.get_authz_roles('thedude')
+    store.get_authz_roles('walter')
+    assert store.cache.get(('roles', 'thedude'))[0] is False
+    assert store.cache.get(('roles', 'walter'))[0] is True
+
+    store.invalidate()
+    monkeypatch.setattr(account_store, 'get_authz_roles_multi',
+                        invalidating(get_authz_roles_multi, 'walter'))
+    store.get_authz_roles_multi(['thedude', 'walter'])
+    assert store.cache.get(('roles', 'thedude'))[0] is True
+    assert store.cache.get(('roles', 'walter'))[0] is False
+
+    monkeypatch.setattr(account_store, 'get_authz_roles_multi',
+                        invalidating(get_authz_roles_multi))
+    store.get_authz_roles_multi(['walter', 'marty'])
+    assert len(store.cache) == 0
+
+    monkeypatch.undo()
+    store.get_authz_roles('walter')
+    assert store.cache.get(('roles', 'walter'))[0] is True
+
+
+def test_invalidation_generations_are_bounded(Session):
+    store = CachingAccountStore(AlchemyAccountStore(session=Session), maxsize=2)
+    for identifier in ['thedude', 'walter', 'marty', 'nocreds']:
+        store.invalidate(identifier)
+    assert len(store._generations) <= 2
+
+    store.get_authz_roles('thedude')
+    assert len(store.cache) == 1
+
+
+def test_caching_account_store_invalidates_locked_accounts(Session):
+    store = CachingAccountStore(AlchemyAccountStore(session=Session))
+    store.get_authz_permissions('thedude')
+    store.get_authz_roles('thedude')
+    store.get_authz_roles('walter')
+
+    store.lock_account('thedude', 1472000000000)
+    assert len(store.cache) == 1
+    assert store.get_authc_info('thedude')['account_locked'] == 1472000000000
+
+    store.unlock_account('walter')
+    assert len(store.cache) == 0
+
+    store.get_authz_roles('walter')
+    store.lock_accounts((identifier for identifier in ['thedude', 'walter']), 1472000000000)
+    assert len(store.cache) == 0
+    assert store.is_account_locked('walter') is True
+
+
+def test_invalidate_changed(Session):
+    account_store = AlchemyAccountStore(session=Session, track_versions=True)
+    store = CachingAccountStore(account_store)
+    assert store.invalidate_changed() == []
+
+    store.get_authz_roles('thedude')
+    store.get_authz_roles('walter')
+    # a change made through another store, of another process
+    AlchemyAccountStore(session=Session, track_versions=True).add_role_member(
+        'walter', 'landlord')
+
+    assert store.invalidate_changed() == ['walter']
+    assert 'landlord' in store.get_authz_roles('walter')
+    assert store.invalidate_changed() == []
@@ -0,0 +1,114 @@
+import pytest
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    FailedAttemptBuffer,
+)
+
+
+def test_buffer_is_due_by_size():
+    buffer = FailedAttemptBuffer(max_size=3)
+    assert buffer.record('thedude', 'password', 1) is False
+    assert buffer.record('walter', 'password', 2) is False
+    assert buffer.record('thedude', 'totp_key', 3) is True
+    assert len(buffer) == 3
+
+
+def test_buffer_is_due_by_interval(timer):
+    buffer = FailedAttemptBuffer(flush_interval=5, timer=timer)
+    assert buffer.due is False
+
+    buffer.record('thedude', 'password', 1)
+    timer.now = 4.9
+    assert buffer.due is False
+    timer.now = 5.0
+    assert buffer.due is True
+
+
+def test_buffer_keeps_the_latest_per_key():
+    buffer = FailedAttemptBuffer(per_key_limit=2)
+    for attempt_millis in [3, 1, 2]:
+        buffer.record('thedude', 'password', attempt_millis)
+
+    assert buffer.pending('thedude') == {'password': [2, 3]}
+    assert buffer.pending('walter') == {}
+    assert len(buffer) == 2
+
+
+def test_buffer_drain_and_requeue():
+    buffer = FailedAttemptBuffer()
+    buffer.record('thedude', 'password', 1)
+    buffer.record('walter', 'password', 2)
+
+    records = buffer.drain()
+    assert sorted(records) == [('thedude', 'password', 1), ('walter', 'password', 2)]
+    assert len(buffer) == 0 and buffer.drain() == []
+
+    buffer.requeue(records)
+    assert len(buffer) == 2
+    assert buffer.pending('walter') == {'password': [2]}
+
+
+def test_buffer_invalid_arguments():
+    with pytest.raises(ValueError):
+        FailedAttemptBuffer(max_size=0)
+    with pytest.raises(ValueError):
+        FailedAttemptBuffer(flush_interval=0)
+    with pytest.raises(ValueError):
+        FailedAttemptBuffer(per_key_limit=0)
+
+
+def test_record_failed_attempt_requires_a_buffer(account_store):
+    with pytest.raises(ValueError):
+        account_store.record_failed_attempt('thedude')
+
+
+def test_flush_failed_attempts(Session):
+    # a flush_interval long enough that only the test flushes
+    store = AlchemyAccountStore(session=Session,
+                                failed_attempts=FailedAttemptBuffer(flush_interval=3600))
+    try:
+        store.record_failed_attempt('thedude', attempt_millis=2000000000000)
+        store.record_failed_attempt('thedude', 'totp_key', attempt_millis=2000000000001)
+        store.record_failed_attempt('ghost', attempt_millis=2000000000002)
+
+        assert store.flush_failed_attempts() == 2
+        assert store.flush_failed_attempts() == 0
+
+        authc_info = store.get_authc_info('thedude')['authc_info']
+        assert authc_info['password']['failed_attempts'] == [2000000000000]
+        assert authc_info['totp_key']['failed_attempts'] == [2000000000001]
+
+        store.record_failed_attempt('walter', attempt_millis=2000000000003)
+    finally:
+        store.close()
+
+    # close flushes what remains
+    authc_info = store.get_authc_info('walter')['authc_info']
+    assert authc_info['password']['failed_attempts'] == [2000000000003]
+
+
+@pytest.mark.parametrize('core_reads', [False, True], ids=['orm', 'core'])
+def test_failed_attempts_of_many_accounts(Session, core_reads):
+    store = AlchemyAccountStore(session=Session, core_reads=core_reads,
+                                failed_attempts=FailedAttemptBuffer(flush_interval=3600))
+    store.multi_chunk_size = 1
+    try:
+        store.record_failed_attempt('thedude', attempt_millis=2000000000000)
+        store.flush_failed_attempts()
+        # pending, rather than flushed
+        store.record_failed_attempt('walter', attempt_millis=2000000000001)
+
+        authc_info = store.get_authc_info_multi(['thedude', 'walter', 'marty', 'ghost'])
+        for identifier in ['thedude', 'walter', 'marty']:
+            assert authc_info[identifier] == store.get_authc_info(identifier)
+        assert authc_info['thedude']['authc_info']['password']['failed_attempts'] == [
+            2000000000000]
+        assert authc_info['walter']['authc_info']['password']['failed_attempts'] == [
+            2000000000001]
+        assert authc_info['ghost'] is None
+
+        account = store.get_account('thedude')
+        assert account['authc_info'] == authc_info['thedude']['authc_info']
+    finally:
+        store.close()
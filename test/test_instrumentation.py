@@ -0,0 +1,54 @@
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    Histogram,
+    Instrumentation,
+)
+
+
+def test_histogram():
+    histogram = Histogram([1, 10, 100])
+    assert histogram.percentile(50) is None
+
+    for value in [0.5, 5, 5, 50, 500]:
+        histogram.add(value)
+
+    assert histogram.percentile(20) == 1
+    assert histogram.percentile(50) == 10
+    assert histogram.percentile(80) == 100
+    assert histogram.percentile(99) == 500
+
+    summary = histogram.dump()
+    assert summary['count'] == 5 and summary['min'] == 0.5 and summary['max'] == 500
+    assert summary['buckets'] == {'1': 1, '10': 2, '100': 1, 'inf': 1}
+
+
+def test_store_calls_are_measured(Session):
+    calls = []
+    instrumentation = Instrumentation(
+        sinks=[lambda method, metrics: calls.append((method, metrics))])
+    store = AlchemyAccountStore(session=Session, instrumentation=instrumentation)
+
+    store.get_authz_roles('thedude')
+    store.get_authz_permissions_multi(['thedude', 'walter'])
+
+    assert [method for method, _ in calls] == [
+        'get_authz_roles', 'get_authz_permissions_multi']
+    roles_metrics, multi_metrics = [metrics for _, metrics in calls]
+    assert roles_metrics['round_trips'] == 1
+    assert roles_metrics['items'] == 3
+    assert roles_metrics['duration_ms'] >= roles_metrics['execute_ms'] > 0
+    assert multi_metrics['round_trips'] == 1
+    assert multi_metrics['items'] == 2
+
+    summary = instrumentation.dump()
+    assert summary['get_authz_roles']['duration_ms']['count'] == 1
+    assert summary['get_authz_roles']['items']['count'] == 1
+
+
+def test_failing_sink_is_logged(Session, caplog):
+    def sink(method, metrics):
+        raise RuntimeError('unreachable statsd')
+
+    store = AlchemyAccountStore(session=Session, instrumentation=Instrumentation([sink]))
+    assert store.get_authz_roles('ghost') == []
+    assert 'Instrumentation sink' in caplog.text
@@ -0,0 +1,39 @@
+import pytest
+
+from yosai_alchemystore import AlchemyAccountStore
+
+
+@pytest.fixture(params=[False, True], ids=['orm', 'core'])
+def store(request, Session):
+    return AlchemyAccountStore(session=Session, core_reads=request.param)
+
+
+def test_lock_and_unlock_account(store):
+    assert store.is_account_locked('thedude') is False
+
+    store.lock_account('thedude', 1472000000000)
+    assert store.is_account_locked('thedude') is True
+    assert store.get_authc_info('thedude')['account_locked'] == 1472000000000
+
+    store.unlock_account('thedude')
+    assert store.is_account_locked('thedude') is False
+    assert store.get_authc_info('thedude')['account_locked'] is None
+
+
+def test_is_account_locked_unknown(store):
+    assert store.is_account_locked('ghost') is None
+
+
+def test_lock_and_unlock_accounts(store):
+    store.multi_chunk_size = 2
+    identifier_s = ['thedude', 'walter', 'marty', 'ghost']
+
+    # a generator is consumed once, however many statements it spans
+    store.lock_accounts((identifier for identifier in identifier_s), 1472000000000)
+    assert [store.is_account_locked(identifier) for identifier in identifier_s] == [
+        True, True, True, None]
+    assert store.is_account_locked('nocreds') is False
+
+    store.unlock_accounts(identifier for identifier in identifier_s)
+    assert [store.is_account_locked(identifier) for identifier in identifier_s] == [
+        False, False, False, None]
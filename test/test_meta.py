@@ -0,0 +1,35 @@
+import types
+
+import pytest
+from sqlalchemy import pool
+
+from yosai_alchemystore import (
+    init_engine,
+    init_session,
+)
+
+
+def settings(**engine_config):
+    engine_config = dict(dict(dialect='sqlite', path='//'), **engine_config)
+    return types.SimpleNamespace(ALCHEMY_STORE=dict(engine_config=engine_config))
+
+
+def test_poolclass_by_name():
+    engine = init_engine('sqlite://', poolclass='StaticPool')
+    assert isinstance(engine.pool, pool.StaticPool)
+
+    with pytest.raises(ValueError):
+        init_engine('sqlite://', poolclass='LakePool')
+
+
+def test_pool_config_of_settings():
+    engine = init_engine(settings=settings(poolclass='QueuePool', pool_size=3,
+                                           max_overflow=None))
+    assert isinstance(engine.pool, pool.QueuePool)
+    assert engine.pool.size() == 3
+
+
+def test_keyword_arguments_take_precedence():
+    Session = init_session(settings=settings(poolclass='QueuePool', pool_size=3),
+                           pool_size=7)
+    assert Session.kw['bind'].pool.size() == 7
@@ -0,0 +1,35 @@
+from sqlalchemy import inspect
+
+from yosai_alchemystore.models.models import (
+    Base,
+    create_missing_indexes,
+)
+
+
+def index_names(engine, table_name):
+    return {index['name'] for index in inspect(engine).get_indexes(table_name)}
+
+
+def test_create_missing_indexes(engine):
+    assert create_missing_indexes(engine) == []
+
+    role_membership = Base.metadata.tables['role_membership']
+    for index in role_membership.indexes:
+        index.drop(engine)
+    assert 'ix_role_membership_user_id' not in index_names(engine, 'role_membership')
+
+    assert create_missing_indexes(engine) == ['ix_role_membership_user_id']
+    assert 'ix_role_membership_user_id' in index_names(engine, 'role_membership')
+
+
+def test_roles_are_looked_up_through_the_user_index(account_store, engine):
+    session = account_store.Session()
+    try:
+        query = account_store._get_roles_query(session, 'thedude').statement
+        sql = str(query.compile(engine, compile_kwargs={'literal_binds': True}))
+    finally:
+        session.close()
+
+    with engine.connect() as connection:
+        plan = ' '.join(str(row) for row in connection.execute('EXPLAIN QUERY PLAN ' + sql))
+    assert 'ix_role_membership_user_id' in plan
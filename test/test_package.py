@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+import pytest
+
+import yosai_alchemystore
+
+
+def test_exports_resolve():
+    for name in yosai_alchemystore.__all__:
+        assert getattr(yosai_alchemystore, name).__name__ == name
+    assert set(yosai_alchemystore.__all__) <= set(dir(yosai_alchemystore))
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        yosai_alchemystore.AccountStore
+
+
+def test_failed_import_reports_its_cause(monkeypatch):
+    def import_module(name, package=None):
+        raise AttributeError("module 'collections' has no attribute 'MutableSet'")
+
+    monkeypatch.delitem(vars(yosai_alchemystore), 'BulkImporter', raising=False)
+    monkeypatch.setattr(yosai_alchemystore.importlib, 'import_module', import_module)
+    with pytest.raises(ImportError, match='MutableSet') as excinfo:
+        yosai_alchemystore.BulkImporter
+    assert isinstance(excinfo.value.__cause__, AttributeError)
+
+
+def test_import_is_lazy():
+    code = ('import sys, yosai_alchemystore\n'
+            'print(sorted(name for name in ["sqlalchemy.orm", "yosai.core"] '
+            'if name in sys.modules))')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().strip() == '[]'
@@ -0,0 +1,87 @@
+import pytest
+
+from yosai_alchemystore import AlchemyAccountStore
+
+
+@pytest.fixture(params=[False, True], ids=['roles', 'effective'])
+def store(request, Session):
+    store = AlchemyAccountStore(session=Session, effective_permissions=request.param)
+    if store.effective_permissions:
+        store.refresh_effective_permissions()
+    return store
+
+
+@pytest.mark.parametrize('identifier, permission, permitted', [
+    ('thedude', ('money', 'deposit', '*'), True),
+    ('thedude', ('money', 'deposit', 'ransom'), True),
+    ('thedude', ('money', 'write', 'bankcheck_19911109069'), True),
+    ('thedude', ('money', 'write', 'ransom'), False),
+    ('thedude', ('money', 'withdrawal', '*'), False),
+    ('thedude', ('leatherduffelbag', 'bowl', 'theringer'), True),
+    ('thedude', ('money', '*', '*'), False),
+    ('marty', ('money', 'withdrawal', 'ransom'), True),
+    ('ghost', ('money', 'deposit', '*'), False),
+])
+def test_is_permitted(store, identifier, permission, permitted):
+    assert store.is_permitted(identifier, *permission) is permitted
+
+
+@pytest.mark.parametrize('options', [{}, dict(bake_queries=False), dict(core_reads=True),
+                                     dict(effective_permissions=True)],
+                         ids=['baked', 'unbaked', 'core', 'effective'])
+def test_is_permitted_multi(Session, options):
+    store = AlchemyAccountStore(session=Session, **options)
+    if store.effective_permissions:
+        store.refresh_effective_permissions()
+    # a permission binds three parameters, so a statement checks two of them
+    store.multi_chunk_size = 7
+    permission_s = [('money', 'deposit', '*'),
+                    ('money', 'withdrawal', '*'),
+                    ('leatherduffelbag', 'access', 'theringer'),
+                    ('leatherduffelbag', 'access', 'ransom'),
+                    ('*', 'run', '*')]
+
+    assert store.is_permitted_multi('walter', permission_s) == [
+        store.is_permitted('walter', *permission) for permission in permission_s]
+    assert store.is_permitted_multi('walter', permission_s) == [True, False, True, False, True]
+    assert store.is_permitted_multi('walter', []) == []
+
+
+def test_is_permitted_multi_statements_are_bounded(Session):
+    store = AlchemyAccountStore(session=Session, core_reads=True)
+    store.multi_chunk_size = 7
+    store.is_permitted_multi('walter', [('money', 'deposit', '*')] * 5)
+    store.is_permitted_multi('thedude', [('money', 'deposit', '*')] * 3)
+
+    statements = {key[2:]: statement for key, statement in store._statements.items()}
+    assert sorted(statements) == [(1,), (2,)]
+    for statement in statements.values():
+        assert len(statement.compile().params) <= store.multi_chunk_size
+
+
+def test_get_permitted_roles(store):
+    assert sorted(store.get_permitted_roles('money', 'deposit')) == ['bankcustomer']
+    assert sorted(store.get_permitted_roles('money', 'bowl')) == [
+        'bankcustomer', 'courier', 'landlord', 'tenant']
+    assert store.get_permitted_roles('money', 'transport') == []
+
+
+@pytest.mark.parametrize('page_size', [1, 2, 1000])
+def test_iter_permitted_users(store, page_size):
+    assert list(store.iter_permitted_users('money', 'deposit', page_size=page_size)) == [
+        'thedude', 'walter', 'marty']
+    assert list(store.iter_permitted_users('money', 'withdrawal', page_size=page_size)) == [
+        'marty']
+    assert list(store.iter_permitted_users('money', 'transport', page_size=page_size)) == []
+
+
+@pytest.mark.parametrize('yield_per', [1, 1000])
+def test_iter_authz_info(store, permission_parts, yield_per):
+    exported = dict(store.iter_authz_info(yield_per=yield_per))
+
+    assert sorted(exported) == ['marty', 'nocreds', 'thedude', 'walter']
+    assert exported['nocreds'] == dict(roles=[], permissions={})
+    for identifier, authz_info in exported.items():
+        assert sorted(authz_info['roles']) == sorted(store.get_authz_roles(identifier))
+        assert (permission_parts(authz_info['permissions']) ==
+                permission_parts(store.get_authz_permissions(identifier)))
@@ -0,0 +1,105 @@
+import datetime
+
+import pytest
+import sqlalchemy
+from sqlalchemy.exc import StatementError
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    BulkImporter,
+)
+from yosai_alchemystore.models.models import (
+    Permission,
+    Role,
+    User,
+)
+
+
+@pytest.fixture
+def importer(engine):
+    return BulkImporter(engine, chunk_size=2)
+
+
+def test_import_accounts(importer, Session, permission_parts):
+    users = [dict(identifier='donny', first_name='Theodore', last_name='Kerabatsos'),
+             dict(identifier='jesus', first_name='Jesus', last_name='Quintana',
+                  account_lock_millis='1472000000000'),
+             dict(identifier='maude', first_name='Maude', last_name='Lebowski')]
+    assert importer.import_users(iter(users)) == 3
+    assert importer.import_roles([dict(title='bowler'), dict(title='bowler'),
+                                  dict(title='courier')]) == 1
+    assert importer.import_credentials([
+        dict(identifier='donny', credential_type='password', credential='pw-donny',
+             expiration_dt='2100-01-01T00:00:00'),
+        dict(identifier='ghost', credential_type='password', credential='pw-ghost',
+             expiration_dt=datetime.datetime(2100, 1, 1))]) == 1
+    assert importer.import_role_memberships([
+        dict(identifier='donny', role='bowler'),
+        dict(identifier='jesus', role='bowler'),
+        dict(identifier='donny', role='bowler'),
+        dict(identifier='ghost', role='bowler')]) == 2
+    assert importer.import_role_permissions([
+        dict(role='bowler', domain='lane', action='bowl', resource=None),
+        dict(role='bowler', domain='lane', action='bowl', resource=None),
+        dict(role='bowler', domain=None, action='run', resource=None)]) == 2
+
+    store = AlchemyAccountStore(session=Session)
+    assert store.get_authc_info('donny')['authc_info']['password']['credential'] == 'pw-donny'
+    assert store.get_authz_roles('jesus') == ['bowler']
+    assert permission_parts(store.get_authz_permissions('donny')) == {
+        '*': {('*', frozenset(['run']), frozenset(['*']))},
+        'lane': {('lane', frozenset(['bowl']), frozenset(['*']))}}
+
+    session = Session()
+    try:
+        assert session.query(User.account_lock_millis).filter(
+            User.identifier == 'jesus').scalar() == 1472000000000
+        # the run permission of the sample data is reused
+        assert session.query(Permission).count() == 8
+    finally:
+        session.close()
+
+
+def test_failed_chunk_forgets_its_names(importer, Session):
+    # the chunk inserts the auditor role before its action fails to bind
+    with pytest.raises(StatementError):
+        importer.import_role_permissions([
+            dict(role='auditor', domain='money', action='audit', resource=None),
+            dict(role='auditor', domain='money', action=object(), resource=None)])
+
+    assert importer.import_role_permissions([
+        dict(role='auditor', domain='money', action='audit', resource=None)]) == 1
+
+    session = Session()
+    try:
+        assert session.query(Role).filter(Role.title == 'auditor').count() == 1
+    finally:
+        session.close()
+    store = AlchemyAccountStore(session=Session)
+    assert store.get_permitted_roles('money', 'audit') == ['auditor']
+
+
+def test_lookups_are_chunked_apart_from_inserts(engine, Session):
+    importer = BulkImporter(engine)
+    importer.lookup_chunk_size = 2
+    selects = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and ' IN ' in statement:
+            selects.append(len(parameters))
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        titles = ['bowler', 'courier', 'tenant', 'landlord', 'nihilist']
+        assert importer.import_roles([dict(title=title) for title in titles]) == 2
+        assert importer.import_role_memberships([
+            dict(identifier=identifier, role='bowler')
+            for identifier in ['thedude', 'walter', 'marty', 'nocreds', 'ghost']]) == 4
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    # the five titles, the five identifiers and the four user ids
+    assert len(selects) == 3 + 3 + 2
+    assert max(selects) <= 2
+    store = AlchemyAccountStore(session=Session)
+    assert 'bowler' in store.get_authz_roles('marty')
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from yosai_alchemystore import AlchemyAccountStore
+from yosai_alchemystore.models.models import (
+    Action,
+    Permission,
+    authz_version,
+    upgrade_schema,
+)
+
+
+@pytest.fixture(params=[False, True], ids=['roles', 'effective'])
+def store(request, Session):
+    store = AlchemyAccountStore(session=Session, effective_permissions=request.param,
+                                track_versions=True)
+    if store.effective_permissions:
+        store.refresh_effective_permissions()
+    return store
+
+
+def withdrawal_id(Session):
+    session = Session()
+    try:
+        return (session.query(Permission.pk_id).join(Action).
+                filter(Action.name == 'withdrawal').scalar())
+    finally:
+        session.close()
+
+
+def actions(store, identifier, domain='money'):
+    permissions = store.get_authz_permissions(identifier)
+    return {action for part in json.loads(permissions.get(domain, '[]'))
+            for action in part['action']}
+
+
+def test_add_and_remove_role_member(store):
+    store.add_role_member('walter', 'landlord')
+    assert 'landlord' in store.get_authz_roles('walter')
+    assert 'withdrawal' in actions(store, 'walter')
+
+    store.remove_role_member('walter', 'landlord')
+    assert 'landlord' not in store.get_authz_roles('walter')
+    assert 'withdrawal' not in actions(store, 'walter')
+
+
+def test_grant_and_revoke_role_permission(store, Session):
+    permission_id = withdrawal_id(Session)
+
+    store.grant_role_permission('courier', permission_id)
+    assert 'withdrawal' in actions(store, 'walter')
+    assert 'withdrawal' in actions(store, 'thedude')
+
+    store.revoke_role_permission('courier', permission_id)
+    assert 'withdrawal' not in actions(store, 'walter')
+    # marty holds it through landlord still
+    assert 'withdrawal' in actions(store, 'marty')
+
+
+def test_get_authz_versions_since(store, Session):
+    version, changes = store.get_authz_versions_since(0)
+    assert changes == {}
+
+    store.add_role_member('walter', 'tenant')
+    version, changes = store.get_authz_versions_since(version)
+    assert list(changes) == ['walter']
+
+    store.grant_role_permission('bankcustomer', withdrawal_id(Session))
+    version, changes = store.get_authz_versions_since(version)
+    assert set(changes) == {'thedude', 'walter', 'marty'}
+
+    assert store.get_authz_versions_since(version) == (version, {})
+
+
+def test_versions_are_not_tracked_by_default(Session):
+    store = AlchemyAccountStore(session=Session)
+    store.add_role_member('walter', 'tenant')
+    assert store.get_authz_versions_since(0) == (0, {})
+
+
+def test_refresh_effective_permissions(Session):
+    store = AlchemyAccountStore(session=Session, effective_permissions=True)
+    assert store.get_authz_permissions('thedude') == {}
+
+    store.refresh_effective_permissions('thedude')
+    assert 'deposit' in actions(store, 'thedude')
+    assert store.get_authz_permissions('walter') == {}
+
+    store.refresh_effective_permissions()
+    assert 'deposit' in actions(store, 'walter')
+
+
+def test_missing_authz_version_row(store, engine):
+    with engine.begin() as connection:
+        connection.execute(authz_version.delete())
+
+    with pytest.raises(RuntimeError, match='upgrade_schema'):
+        store.add_role_member('walter', 'tenant')
+    assert 'tenant' not in store.get_authz_roles('walter')
+
+    upgrade_schema(engine)
+    store.add_role_member('walter', 'tenant')
+    assert 'tenant' in store.get_authz_roles('walter')
+    assert list(store.get_authz_versions_since(0)[1]) == ['walter']
+
+
+def test_role_hierarchy(Session):
+    store = AlchemyAccountStore(session=Session, role_hierarchy=True)
+
+    store.add_role_parent('courier', 'landlord')
+    assert sorted(store.get_authz_roles('walter')) == ['bankcustomer', 'courier', 'landlord']
+    assert 'withdrawal' in actions(store, 'walter')
+
+    store.add_role_parent('landlord', 'tenant')
+    assert 'tenant' in store.get_authz_roles('walter')
+
+    with pytest.raises(ValueError):
+        store.add_role_parent('tenant', 'courier')
+    with pytest.raises(ValueError):
+        store.add_role_parent('tenant', 'tenant')
+
+    store.remove_role_parent('courier', 'landlord')
+    assert sorted(store.get_authz_roles('walter')) == ['bankcustomer', 'courier']
+    assert 'withdrawal' not in actions(store, 'walter')
@@ -0,0 +1,95 @@
+import pytest
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    Base,
+    ReplicaRouter,
+    init_session,
+)
+from yosai_alchemystore.accountstore.routing import RecentWrites
+
+from conftest import create_engine
+
+
+@pytest.fixture
+def replica_session():
+    # an empty replica, that hasn't caught up with any of the primary's writes
+    engine = create_engine()
+    Base.metadata.create_all(engine)
+    yield init_session(engine=engine)
+    engine.dispose()
+
+
+def test_round_robin():
+    router = ReplicaRouter(['a', 'b', 'c'])
+    assert [router.choose() for _ in range(5)] == ['a', 'b', 'c', 'a', 'b']
+
+
+def test_least_loaded(engine, replica_session):
+    primary_session = init_session(engine=engine)
+    router = ReplicaRouter([primary_session, replica_session], policy='least_loaded')
+    assert router.choose() is primary_session
+
+    session = primary_session()
+    session.connection()
+    try:
+        assert router.choose() is replica_session
+    finally:
+        session.close()
+    assert router.choose() is primary_session
+
+
+def test_router_invalid_arguments():
+    with pytest.raises(ValueError):
+        ReplicaRouter([])
+    with pytest.raises(ValueError):
+        ReplicaRouter(['a'], policy='random')
+    with pytest.raises(ValueError):
+        ReplicaRouter(['a'], policy='least_loaded')
+
+
+def test_recent_writes_expire(timer):
+    recent_writes = RecentWrites(10, timer=timer)
+
+    recent_writes.add(['thedude', 'walter'])
+    timer.now = 5
+    recent_writes.add(identifier for identifier in ['walter'])
+    assert 'thedude' in recent_writes and 'walter' in recent_writes
+    assert 'marty' not in recent_writes
+
+    timer.now = 10
+    assert 'thedude' not in recent_writes and 'walter' in recent_writes
+    timer.now = 15
+    assert 'walter' not in recent_writes
+
+    timer.now = 20
+    recent_writes.add(['marty'])
+    assert list(recent_writes._expiries) == ['marty']
+
+
+def test_reads_are_routed_to_replicas(Session, replica_session):
+    store = AlchemyAccountStore(session=Session, replica_sessions=[replica_session])
+
+    assert store.get_authc_info('thedude') is None
+    assert store.get_authz_roles('thedude') == []
+
+    users = Base.metadata.tables['user']
+    with store.session_scope() as session:
+        assert session.query(users).count() == 4
+    with store.session_scope(replica=True) as session:
+        assert session.query(users).count() == 0
+
+
+def test_read_your_writes(Session, replica_session):
+    store = AlchemyAccountStore(session=Session, replica_sessions=[replica_session],
+                                read_your_writes=60)
+
+    store.lock_account('thedude', 1472000000000)
+    assert store.is_account_locked('thedude') is True
+    assert store.get_authc_info('thedude')['account_locked'] == 1472000000000
+    authc_info = store.get_authc_info_multi(['thedude', 'walter'])
+    assert authc_info['walter']['account_locked'] is None
+    # roles aren't lock state, and are read from the replica still
+    assert store.get_authz_roles('thedude') == []
+    assert store.get_authc_info('walter') is None
+    assert store.is_account_locked('walter') is None
@@ -1,13 +1,64 @@
-from .conf.settings import (
-    AccountStoreSettings,
-)
-
-from .meta.meta import (
-    Base,
-    init_engine,
-    init_session,
-)
-
-from .accountstore.accountstore import (
-    AlchemyAccountStore,
-)
+"""
+The package's public names are imported from their submodules on first
+access, so that importing yosai_alchemystore doesn't import SQLAlchemy's ORM,
+the models or yosai.core until they are used.
+"""
+import importlib
+
+# name: the submodule that defines it
+_exports = {
+    'AccountStoreSettings': '.conf.settings',
+
+    'Base': '.meta.meta',
+    'init_engine': '.meta.meta',
+    'init_session': '.meta.meta',
+    'init_async_engine': '.meta.meta',
+    'init_async_session': '.meta.meta',
+    'init_replica_sessions': '.meta.meta',
+    'init_async_replica_sessions': '.meta.meta',
+
+    'PermissionInterner': '.accountstore.permissions',
+    'PermissionParts': '.accountstore.permissions',
+
+    'FailedAttemptBuffer': '.accountstore.failedattempts',
+
+    'ReplicaRouter': '.accountstore.routing',
+
+    'AlchemyAccountStore': '.accountstore.accountstore',
+
+    'CachingAccountStore': '.accountstore.cache',
+    'LRUCache': '.accountstore.cache',
+
+    'Histogram': '.accountstore.instrumentation',
+    'Instrumentation': '.accountstore.instrumentation',
+    'logging_sink': '.accountstore.instrumentation',
+    'statsd_sink': '.accountstore.instrumentation',
+
+    'AsyncAlchemyAccountStore': '.accountstore.asyncstore',
+
+    'BulkImporter': '.provisioning.provisioning',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    try:
+        module = _exports[name]
+    except KeyError:
+        msg = 'module {0!r} has no attribute {1!r}'.format(__name__, name)
+        raise AttributeError(msg)
+
+    try:
+        value = getattr(importlib.import_module(module, __name__), name)
+    except AttributeError as exc:
+        # else "from yosai_alchemystore import name" reports only that it
+        # cannot import name, hiding the cause
+        msg = 'cannot import {0} from {1}{2}: {3}'.format(name, __name__, module, exc)
+        raise ImportError(msg) from exc
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
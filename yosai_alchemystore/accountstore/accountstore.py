@@ -16,26 +16,74 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
+import atexit
+import collections
+import contextlib
+import contextvars
 import functools
-from sqlalchemy import case, cast, func, Text
-from sqlalchemy.sql import Alias, ColumnElement
+import json
+import threading
+import time
+from sqlalchemy import (
+    and_,
+    bindparam,
+    case,
+    cast,
+    exists,
+    func,
+    literal,
+    null,
+    or_,
+    select,
+    Text,
+    true,
+    union_all,
+)
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.sql import ColumnElement, FromClause
 from sqlalchemy.ext.compiler import compiles
 
+try:
+    from sqlalchemy.sql.visitors import InternalTraversal
+except ImportError:  # SQLAlchemy < 1.4, which has no statement cache
+    InternalTraversal = None
+
 from yosai_alchemystore import (
-    init_session
+    init_replica_sessions,
+    init_session,
 )
 
 from yosai_alchemystore.models.models import (
     Credential,
     CredentialType,
+    FailedAttempt,
     User,
     Domain,
     Action,
     Resource,
     Permission,
     Role,
+    role_closure as role_closure_table,
+    role_hierarchy as role_hierarchy_table,
     role_membership as role_membership_table,
     role_permission as role_permission_table,
+    user_effective_permission as user_effective_permission_table,
+    authz_version as authz_version_table,
+    user_authz_version as user_authz_version_table,
+)
+
+from yosai_alchemystore.accountstore.failedattempts import (
+    FlushThread,
+)
+
+from yosai_alchemystore.accountstore.permissions import (
+    PermissionInterner,
+)
+
+from yosai_alchemystore.accountstore.routing import (
+    RecentWrites,
+    ReplicaRouter,
 )
 
 from yosai.core import (
@@ -49,33 +97,188 @@ from yosai.core import (
 
 
 class as_row(ColumnElement):
+    # SQLAlchemy 1.4 caches the statement by the cache key of expr
+    inherit_cache = True
+    if InternalTraversal is not None:
+        _traverse_internals = [('expr', InternalTraversal.dp_clauseelement)]
+
     def __init__(self, expr):
-        assert isinstance(expr, Alias)
+        # an Alias, or as of SQLAlchemy 1.4, the Subquery of Query.subquery()
+        assert isinstance(expr, FromClause)
         self.expr = expr
 
 
 @compiles(as_row)
 def _gen_as_row(element, compiler, **kw):
-    return compiler.visit_alias(element.expr, ashint=True, **kw)
+    return element.expr._compiler_dispatch(compiler, ashint=True, **kw)
 
 
 # -------------------------------------------------------
 # -------------------------------------------------------
 
 
+# the sessions of the active session_scope of each store, by id(store)
+_scoped_sessions = contextvars.ContextVar('yosai_alchemystore_scoped_sessions',
+                                          default={})
+
+
+def _called_identifier(args, kwargs):
+    """
+    :returns: the identifier, or identifiers, that a store method was called
+              with
+    """
+    if len(args) > 1:
+        return args[1]
+    return kwargs.get('identifier', kwargs.get('identifier_s'))
+
+
 def session_context(fn):
     """
-    Handles session setup and teardown
+    Handles session setup and teardown.  Within a session_scope, the scope's
+    session is used and is left open for the calls that follow.
     """
     @functools.wraps(fn)
     def wrap(*args, **kwargs):
-        session = args[0].Session()  # obtain from self
-        result = fn(*args, session=session, **kwargs)
-        session.close()
-        return result
+        store = args[0]  # obtain from self
+        session, owned = store._obtain_session(fn.__name__,
+                                               _called_identifier(args, kwargs))
+        try:
+            if store.instrumentation is None:
+                return fn(*args, session=session, **kwargs)
+
+            measurement, token = store.instrumentation.start(fn.__name__,
+                                                             session.get_bind())
+            result = None
+            try:
+                started = time.perf_counter()
+                session.connection()
+                store.instrumentation.checked_out(measurement, started)
+                result = fn(*args, session=session, **kwargs)
+                return result
+            finally:
+                store.instrumentation.finish(measurement, token, result)
+        finally:
+            if owned:
+                session.close()
     return wrap
 
 
+def _group_permission_parts(rows):
+    """
+    Groups flat (domain, action, resource) rows the same way that the
+    postgres aggregation of _get_permissions_query does:  actions are
+    collected per (domain, resource), and resources are then collected per
+    (domain, actions).
+
+    :returns: a dict of domain to a list of (domain, actions, resources)
+    """
+    actions = collections.defaultdict(set)
+    for domain, action, resource in rows:
+        actions[(domain, resource)].add(action)
+
+    resources = collections.defaultdict(set)
+    for (domain, resource), action_s in actions.items():
+        resources[(domain, frozenset(action_s))].add(resource)
+
+    parts = collections.defaultdict(list)
+    for (domain, action_s), resource_s in resources.items():
+        parts[domain].append((domain, action_s, resource_s))
+    return parts
+
+
+def _group_permissions(rows):
+    """
+    :returns: a dict of domain to a json list of permission parts, as
+              aggregated by _get_permissions_query
+    """
+    return {domain: json.dumps([{'domain': domain,
+                                 'action': sorted(action_s),
+                                 'resource': sorted(resource_s)}
+                                for domain, action_s, resource_s in domain_parts])
+            for domain, domain_parts in _group_permission_parts(rows).items()}
+
+
+def _role_closure(edges):
+    """
+    :param edges: the (parent_role_id, child_role_id) pairs of role_hierarchy
+    :returns: the set of (ancestor_id, descendant_id) pairs of role_closure
+    """
+    parents = collections.defaultdict(set)
+    for parent_id, child_id in edges:
+        parents[child_id].add(parent_id)
+
+    closure = set()
+    for role_id in parents:
+        ancestors, stack = set(), list(parents[role_id])
+        while stack:
+            ancestor_id = stack.pop()
+            if ancestor_id not in ancestors:
+                ancestors.add(ancestor_id)
+                stack.extend(parents.get(ancestor_id, ()))
+        closure.update((ancestor_id, role_id) for ancestor_id in ancestors
+                       if ancestor_id != role_id)
+    return closure
+
+
+def _implies(domain, action, resource):
+    """
+    The criterion of the Permissions that imply a permission, where a null
+    domain, action or resource is the '*' wildcard that implies any name.  A
+    requested '*' is implied only by the wildcard.  Requires the outer joins
+    of Permission to Domain, Action and Resource.
+    """
+    return and_(or_(Permission.domain_id.is_(None), Domain.name == domain),
+                or_(Permission.action_id.is_(None), Action.name == action),
+                or_(Permission.resource_id.is_(None), Resource.name == resource))
+
+
+def _kind(name):
+    """
+    The kind column of the rows of a UNION ALL of several kinds of rows
+    """
+    return literal(name, Text).label('kind')
+
+
+def _empty():
+    return cast(null(), Text)
+
+
+def _check_required_row(statement, result):
+    """
+    Raises when a statement that must update a row, such as the advance of
+    the authz_version counter, updates none
+    """
+    if statement.get_execution_options().get('requires_row') and result.rowcount == 0:
+        msg = ('{0} has no row to update; upgrade the database with '
+               'models.upgrade_schema'.format(statement.table.name))
+        raise RuntimeError(msg)
+
+
+def _with(mapping, key, value):
+    """
+    :returns: a copy of a mapping with an item added
+    """
+    mapping = dict(mapping)
+    mapping[key] = value
+    return mapping
+
+
+def _unique(identifier_s):
+    """
+    Removes duplicate identifiers, preserving the order given
+    """
+    return list(collections.OrderedDict.fromkeys(identifier_s))
+
+
+def _chunked(items, size):
+    """
+    Splits a list into lists of at most size items, keeping IN clauses
+    within the bind-parameter limits of the database (sqlite: 999)
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
                           account_abcs.AuthorizationAccountStore,
                           account_abcs.LockingAccountStore):
@@ -88,17 +291,397 @@ class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
     step 3:  return results
     """
 
-    def __init__(self, db_url=None, session=None, settings=None):
+    # the maximum number of identifiers bound to a single IN clause by the
+    # *_multi methods
+    multi_chunk_size = 500
+
+    # the lookups that are served by a read replica, when there are replicas
+    replica_methods = frozenset(['get_authc_info', 'get_authc_info_multi',
+                                 'get_authz_permissions', 'get_authz_permissions_multi',
+                                 'get_authz_roles', 'get_authz_roles_multi',
+                                 'get_account', 'get_authz_versions_since',
+                                 'is_account_locked', 'is_permitted', 'is_permitted_multi',
+                                 'get_permitted_roles', 'iter_permitted_users',
+                                 'iter_authz_info'])
+
+    # the lookups that return lock state, which read_your_writes pins to the
+    # primary after an account is locked or unlocked
+    lock_state_methods = frozenset(['get_authc_info', 'get_authc_info_multi', 'get_account',
+                                    'is_account_locked'])
+
+    # the failed attempts of the last failed_attempt_window milliseconds, up
+    # to failed_attempt_limit of them, are returned by get_authc_info
+    failed_attempt_window = 60 * 60 * 1000
+    failed_attempt_limit = 100
+
+    def __init__(self, db_url=None, session=None, settings=None,
+                 permission_strategy='auto', bake_queries=True,
+                 effective_permissions=False, instrumentation=None,
+                 core_reads=False, permission_format='json', interner=None,
+                 replica_urls=None, replica_sessions=None, replica_policy='round_robin',
+                 read_your_writes=None, track_versions=False, failed_attempts=None,
+                 role_hierarchy=False):
         """
         :param db_url: engine configuration that is in the
                        'Database URL' format as supported by SQLAlchemy:
             http://docs.sqlalchemy.org/en/latest/core/engines.html#database-urls
+                       The engine, and the replicas' engines, are created on
+                       first use rather than by the constructor.
         :type db_url: string
+
+        :param permission_strategy: how permissions are grouped by domain:
+            'aggregate' -- in the database, using postgres json aggregation
+            'flat' -- in python, from flat (domain, action, resource) rows
+            'auto' -- 'aggregate' for postgresql, otherwise 'flat'
+        :type permission_strategy: string
+
+        :param bake_queries: whether queries are constructed and compiled once
+                             per store and cached (baked), rather than for
+                             every call
+        :type bake_queries: bool
+
+        :param effective_permissions: whether permissions are read from, and
+                                      role changes made through this store are
+                                      maintained in, the denormalized
+                                      user_effective_permission table
+        :type effective_permissions: bool
+
+        :param instrumentation: records the timings, round trips and number of
+                                items returned of every call, when provided
+        :type instrumentation: Instrumentation
+
+        :param core_reads: whether lookups are executed as Core selects that
+                           return plain rows, bypassing the ORM's identity
+                           map, instrumentation and autoflush
+        :type core_reads: bool
+
+        :param permission_format: the form of the permissions returned for
+                                  each domain:
+            'json' -- a json list of parts, as yosai caches and parses them
+            'compact' -- a tuple of PermissionParts, whose names and name
+                         sets are shared among all users through interner
+        :type permission_format: string
+
+        :param interner: the PermissionInterner of the 'compact' format,
+                         which may be shared among stores
+        :type interner: PermissionInterner
+
+        :param replica_urls: 'Database URL's of read replicas, to which the
+                             replica_methods are routed.  Defaults to the
+                             replicas of the YAML engine_config when the store
+                             is configured from settings.
+        :type replica_urls: list
+
+        :param replica_sessions: Session factories of the read replicas, used
+                                 rather than replica_urls
+        :type replica_sessions: list
+
+        :param replica_policy: how a replica is chosen for each read:
+                               'round_robin' or 'least_loaded'
+        :type replica_policy: string
+
+        :param read_your_writes: the number of seconds after an account is
+                                 locked or unlocked through this store for
+                                 which its lock_state_methods read from the
+                                 primary rather than a lagging replica
+        :type read_your_writes: float
+
+        :param track_versions: whether role changes made through this store
+                               stamp the affected users with a new version in
+                               user_authz_version, as obtained through
+                               get_authz_versions_since
+        :type track_versions: bool
+
+        :param failed_attempts: the write-behind buffer of the failed
+                                authentication attempts recorded through
+                                record_failed_attempt, which get_authc_info
+                                then returns.  Attempts aren't tracked unless
+                                a buffer is provided.
+        :type failed_attempts: FailedAttemptBuffer
+
+        :param role_hierarchy: whether roles and permissions inherited through
+                               role_hierarchy are included, by way of
+                               role_closure, in the roles and permissions of
+                               users
+        :type role_hierarchy: bool
         """
-        if session is None:
-            self.Session = init_session(db_url=db_url, settings=settings)
+        if permission_strategy not in ('auto', 'aggregate', 'flat'):
+            msg = ("permission_strategy must be one of 'auto', 'aggregate' or "
+                   "'flat', not {0}".format(permission_strategy))
+            raise ValueError(msg)
+        self.permission_strategy = permission_strategy
+
+        if permission_format not in ('json', 'compact'):
+            msg = ("permission_format must be one of 'json' or 'compact', "
+                   "not {0}".format(permission_format))
+            raise ValueError(msg)
+        self.permission_format = permission_format
+        self.interner = interner if interner is not None else PermissionInterner()
+        self.bakery = baked.bakery() if bake_queries else None
+        self.effective_permissions = effective_permissions
+        self.track_versions = track_versions
+        self.role_hierarchy = role_hierarchy
+        self.failed_attempts = failed_attempts
+        self._flush_thread = None
+        self._flush_lock = threading.Lock()
+        self.instrumentation = instrumentation
+        self.core_reads = core_reads
+        self._statements = {}
+        self._compiled_cache = {}
+
+        self._db_url = db_url
+        self._settings = settings
+        self._session = session
+        self._init_lock = threading.Lock()
+
+        # replicas of replica_urls, or of the settings, are routed on first use
+        if replica_sessions is None and (replica_urls is not None or
+                                         (session is None and db_url is None)):
+            self._replica_config = (replica_urls, replica_policy)
+            self._replicas = None
         else:
-            self.Session = session
+            self._replica_config = None
+            self._replicas = (ReplicaRouter(replica_sessions, replica_policy)
+                              if replica_sessions else None)
+        self.recent_writes = RecentWrites(read_your_writes) if read_your_writes else None
+
+    def _init_session(self):
+        return init_session(db_url=self._db_url, settings=self._settings)
+
+    def _init_replica_sessions(self, replica_urls):
+        return init_replica_sessions(replica_urls, settings=self._settings)
+
+    @property
+    def Session(self):
+        """
+        The primary's Session factory, whose engine is created on first use
+        """
+        if self._session is None:
+            with self._init_lock:
+                if self._session is None:
+                    self._session = self._init_session()
+        return self._session
+
+    @property
+    def replicas(self):
+        """
+        The ReplicaRouter of the read replicas, whose engines are created on
+        first use, or None when there are no replicas
+        """
+        if self._replica_config is not None:
+            with self._init_lock:
+                if self._replica_config is not None:
+                    replica_urls, replica_policy = self._replica_config
+                    replica_sessions = self._init_replica_sessions(replica_urls)
+                    self._replicas = (ReplicaRouter(replica_sessions, replica_policy)
+                                      if replica_sessions else None)
+                    self._replica_config = None
+        return self._replicas
+
+    def _permissions_from_rows(self, rows):
+        """
+        :param rows: flat (domain, action, resource) rows
+        :returns: a dict of domain to permissions, in permission_format
+        """
+        if self.permission_format == 'json':
+            return _group_permissions(rows)
+
+        parts = self.interner.parts
+        return {domain: tuple(parts(*domain_parts) for domain_parts in part_s)
+                for domain, part_s in _group_permission_parts(rows).items()}
+
+    def _permissions_from_aggregate(self, rows):
+        """
+        :param rows: (domain, json parts) rows, as aggregated by the database
+        :returns: a dict of domain to permissions, in permission_format
+        """
+        if self.permission_format == 'json':
+            # a Core result has keys() of its own, so isn't passed to dict()
+            return {domain: parts for domain, parts in rows}
+
+        return {domain: self.interner.from_json(text) for domain, text in rows}
+
+    def _reads_replica(self, method, identifier):
+        """
+        :returns: True when a call of method is to be served by a replica
+        """
+        if self.replicas is None or method not in self.replica_methods:
+            return False
+        if self.recent_writes is None or method not in self.lock_state_methods:
+            return True
+
+        identifier_s = identifier if isinstance(identifier, (list, tuple, set)) else [identifier]
+        return not any(identifier in self.recent_writes for identifier in identifier_s)
+
+    def _wrote_lock_state(self, identifier_s):
+        if self.recent_writes is not None:
+            self.recent_writes.add(identifier_s)
+
+    def _scope(self, replica):
+        """
+        :returns: a (key, Session factory) tuple of a session_scope, whose
+                  session is kept in _scoped_sessions by key
+        """
+        if replica and self.replicas is not None:
+            return (id(self), 'replica'), self.replicas.choose()
+        return id(self), self.Session
+
+    def _obtain_session(self, method=None, identifier=None):
+        """
+        Obtains the session of a call of method:  a read replica's session for
+        the replica_methods, when there are replicas, and otherwise the
+        primary's.  A session_scope's session is used when there is one.
+
+        :returns: a (session, owned) tuple, where an owned session is to be
+                  closed by the caller once it is done
+        """
+        sessions = _scoped_sessions.get()
+        if self._reads_replica(method, identifier):
+            # a primary scope serves reads too, observing its own writes
+            session = sessions.get((id(self), 'replica'), sessions.get(id(self)))
+            Session = self.replicas.choose() if session is None else None
+        else:
+            session = sessions.get(id(self))
+            Session = self.Session
+
+        if session is not None:
+            return session, False
+
+        # a scoped_session's registry session is removed by the application
+        return Session(), not isinstance(Session, scoped_session)
+
+    @contextlib.contextmanager
+    def session_scope(self, replica=False):
+        """
+        Shares a single session, and so a single connection checkout, among
+        all of the store calls made within the scope, such as the
+        authentication and authorization lookups of a request:
+
+            with account_store.session_scope():
+                account_store.get_authc_info(identifier)
+                account_store.get_authz_roles(identifier)
+
+        The session is rolled back if the scope raises and is always closed.
+        Nested scopes share the outermost scope's session.
+
+        A replica scope shares a read replica's session among the
+        replica_methods called within it, while the other calls are made
+        through the primary as usual.
+        """
+        key, Session = self._scope(replica)
+        sessions = _scoped_sessions.get()
+        if key in sessions:
+            yield sessions[key]
+            return
+
+        session = Session()
+        token = _scoped_sessions.set(_with(sessions, key, session))
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            _scoped_sessions.reset(token)
+            session.close()
+
+    def _aggregates_permissions(self, session):
+        """
+        :returns: True when permissions are to be grouped by the database
+        :raises ValueError: if the 'aggregate' strategy is used with a
+                            database other than postgresql
+        """
+        dialect = session.bind.dialect.name
+        if self.permission_strategy == 'auto':
+            return dialect == 'postgresql'
+        if self.permission_strategy == 'aggregate' and dialect != 'postgresql':
+            msg = ("permission_strategy 'aggregate' requires postgresql, not {0}; "
+                   "use 'auto' or 'flat'".format(dialect))
+            raise ValueError(msg)
+        return self.permission_strategy == 'aggregate'
+
+    def _query(self, session, builder, identifier, shape=(), **params):
+        """
+        Obtains the rows of a _get_*_query builder for an identifier, or for
+        a list of identifiers, binding any other parameters of the builder's
+        bindparams.
+
+        Baked queries are built with the identifier as a bound parameter, so
+        the query construction and SQL compilation happen only once per
+        builder, rather than on every call.  With core_reads, the builder's
+        statement is likewise built once and executed through Core, yielding
+        plain rows.
+
+        :param shape: further arguments of the builder that change the
+                      statement it builds, such as a number of terms, and so
+                      are part of its cache key
+        :type shape: tuple
+        """
+        if self.bakery is None and not self.core_reads:
+            query = builder(session, identifier, *shape)
+            return query.params(**params) if params else query
+
+        if isinstance(identifier, (list, tuple)):
+            param = bindparam('identifier_s', expanding=True)
+            params['identifier_s'] = identifier
+        else:
+            param = bindparam('identifier')
+            params['identifier'] = identifier
+
+        key = (builder.__name__, self._aggregates_permissions(session)) + tuple(shape)
+
+        if self.core_reads:
+            statement = self._statements.get(key)
+            if statement is None:
+                statement = self._statements[key] = builder(session, param, *shape).statement
+            connection = session.connection().execution_options(
+                compiled_cache=self._compiled_cache)
+            return connection.execute(statement, params)
+
+        bq = self.bakery(lambda s: builder(s, param, *shape), *key)
+        return bq(session).params(**params)
+
+    def _memberships(self):
+        """
+        :returns: the (role_id, user_id) selectable of the role memberships of
+                  users:  role_membership, or with role_hierarchy, its union
+                  with the memberships of the ancestors of each member's roles.
+                  A UNION ALL lets the database push a user's criteria into
+                  both of its selects, but yields a role as many times as the
+                  user inherits it.
+        """
+        if not self.role_hierarchy:
+            return role_membership_table
+
+        rm, rc = role_membership_table, role_closure_table
+        inherited = (select([rc.c.ancestor_id.label('role_id'), rm.c.user_id]).
+                     select_from(rm.join(rc, rc.c.descendant_id == rm.c.role_id)))
+        return (union_all(select([rm.c.role_id, rm.c.user_id]), inherited).
+                alias('effective_role_membership'))
+
+    def _distinct_roles(self, query):
+        """
+        Removes the duplicate roles of _memberships from a query of roles
+        """
+        return query.distinct() if self.role_hierarchy else query
+
+    def _join_permissions(self, query):
+        """
+        Joins a query that selects from User to the Permissions granted to it,
+        either through its roles or through user_effective_permission
+        """
+        if self.effective_permissions:
+            return (query.
+                    join(user_effective_permission_table,
+                         User.pk_id == user_effective_permission_table.c.user_id).
+                    join(Permission,
+                         user_effective_permission_table.c.permission_id == Permission.pk_id))
+
+        rm = self._memberships()
+        return (query.
+                join(rm, User.pk_id == rm.c.user_id).
+                join(role_permission_table, rm.c.role_id == role_permission_table.c.role_id).
+                join(Permission, role_permission_table.c.permission_id == Permission.pk_id))
 
     def _get_user_query(self, session, identifier):
         return session.query(User).filter(User.identifier == identifier)
@@ -118,52 +701,230 @@ class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
               r) parts
         group by domain;
         """
+        return self._aggregate_permissions_query(session, User.identifier == identifier)
+
+    def _get_permissions_multi_query(self, session, identifier_s):
+        """
+        The same aggregation as _get_permissions_query, carrying the user
+        identifier through every stage so that results for many users can be
+        obtained from a single statement:  (identifier, domain, permissions)
+
+        :type identifier_s: list
+        """
+        return self._aggregate_permissions_query(session,
+                                                 User.identifier.in_(identifier_s),
+                                                 by_identifier=True)
+
+    def _aggregate_permissions_query(self, session, criterion, by_identifier=False):
         thedomain = case([(Domain.name == None, '*')], else_=Domain.name)
         theaction = case([(Action.name == None, '*')], else_=Action.name)
         theresource = case([(Resource.name == None, '*')], else_=Resource.name)
 
         action_agg = func.array_agg(theaction.distinct())
 
+        keys1 = [User.identifier] if by_identifier else []
+        stmt1 = self._join_permissions(
+            session.query(*(keys1 + [Permission.domain_id,
+                                     thedomain.label('domain'),
+                                     Permission.resource_id,
+                                     theresource.label('resource'),
+                                     action_agg.label('action')])).
+            select_from(User))
         stmt1 = (
-            session.query(Permission.domain_id,
-                          thedomain.label('domain'),
-                          Permission.resource_id,
-                          theresource.label('resource'),
-                          action_agg.label('action')).
-            select_from(User).
-            join(role_membership_table, User.pk_id == role_membership_table.c.user_id).
-            join(role_permission_table, role_membership_table.c.role_id == role_permission_table.c.role_id).
-            join(Permission, role_permission_table.c.permission_id == Permission.pk_id).
+            stmt1.
             outerjoin(Domain, Permission.domain_id == Domain.pk_id).
             outerjoin(Action, Permission.action_id == Action.pk_id).
             outerjoin(Resource, Permission.resource_id == Resource.pk_id).
-            filter(User.identifier == identifier).
-            group_by(Permission.domain_id, Domain.name, Permission.resource_id, Resource.name)).subquery()
+            filter(criterion).
+            group_by(*(keys1 + [Permission.domain_id, Domain.name,
+                                Permission.resource_id, Resource.name]))).subquery()
 
-        stmt2 = (session.query(stmt1.c.domain,
-                               stmt1.c.action,
-                               func.array_agg(stmt1.c.resource.distinct()).label('resource')).
+        keys2 = [stmt1.c.identifier] if by_identifier else []
+        resource_agg = func.array_agg(stmt1.c.resource.distinct())
+        stmt2 = (session.query(*(keys2 + [stmt1.c.domain,
+                                          stmt1.c.action,
+                                          resource_agg.label('resource')])).
                  select_from(stmt1).
-                 group_by(stmt1.c.domain, stmt1.c.action)).subquery()
+                 group_by(*(keys2 + [stmt1.c.domain, stmt1.c.action]))).subquery()
 
-        stmt3 = (session.query(stmt2.c.domain,
-                               func.row_to_json(as_row(stmt2)).label('parts')).
-                 select_from(stmt2)).subquery()
+        if by_identifier:
+            # row_to_json would serialize the identifier along with the parts,
+            # so the parts object is built explicitly instead
+            parts = func.json_build_object('domain', stmt2.c.domain,
+                                           'action', stmt2.c.action,
+                                           'resource', stmt2.c.resource)
+            stmt3 = (session.query(stmt2.c.identifier,
+                                   stmt2.c.domain,
+                                   parts.label('parts')).
+                     select_from(stmt2)).subquery()
+        else:
+            stmt3 = (session.query(stmt2.c.domain,
+                                   func.row_to_json(as_row(stmt2)).label('parts')).
+                     select_from(stmt2)).subquery()
 
-        final = (session.query(stmt3.c.domain, cast(func.json_agg(stmt3.c.parts), Text)).
+        keys3 = [stmt3.c.identifier] if by_identifier else []
+        final = (session.query(*(keys3 + [stmt3.c.domain,
+                                          cast(func.json_agg(stmt3.c.parts), Text)])).
                  select_from(stmt3).
-                 group_by(stmt3.c.domain))
+                 group_by(*(keys3 + [stmt3.c.domain])))
 
         return final
 
+    def _get_permission_rows_query(self, session, identifier):
+        """
+        The dialect-neutral counterpart of _get_permissions_query, obtaining
+        flat rows that are grouped by _group_permissions:
+
+        select distinct (case when domain is null then '*' else domain end) as domain,
+                        (case when action is null then '*' else action end) as action,
+                        (case when resource is null then '*' else resource end) as resource
+          from permission ...
+         where user.identifier = :identifier
+        """
+        return self._flat_permissions_query(session, User.identifier == identifier)
+
+    def _get_permission_rows_multi_query(self, session, identifier_s):
+        """
+        :type identifier_s: list
+        :returns: a query of (identifier, domain, action, resource) rows
+        """
+        return self._flat_permissions_query(session,
+                                            User.identifier.in_(identifier_s),
+                                            by_identifier=True)
+
+    def _flat_permissions_query(self, session, criterion, by_identifier=False):
+        thedomain = case([(Domain.name.is_(None), '*')], else_=Domain.name)
+        theaction = case([(Action.name.is_(None), '*')], else_=Action.name)
+        theresource = case([(Resource.name.is_(None), '*')], else_=Resource.name)
+
+        keys = [User.identifier] if by_identifier else []
+        query = self._join_permissions(
+            session.query(*(keys + [thedomain.label('domain'),
+                                    theaction.label('action'),
+                                    theresource.label('resource')])).
+            select_from(User))
+        return (query.
+                outerjoin(Domain, Permission.domain_id == Domain.pk_id).
+                outerjoin(Action, Permission.action_id == Action.pk_id).
+                outerjoin(Resource, Permission.resource_id == Resource.pk_id).
+                filter(criterion).
+                distinct())
+
     def _get_roles_query(self, session, identifier):
         """
         :type identifier: string
         """
-        return (session.query(Role).
-                join(role_membership_table, Role.pk_id == role_membership_table.c.role_id).
-                join(User, role_membership_table.c.user_id == User.pk_id).
-                filter(User.identifier == identifier))
+        rm = self._memberships()
+        return self._distinct_roles(session.query(Role).
+                                    join(rm, Role.pk_id == rm.c.role_id).
+                                    join(User, rm.c.user_id == User.pk_id).
+                                    filter(User.identifier == identifier))
+
+    def _get_roles_multi_query(self, session, identifier_s):
+        """
+        :type identifier_s: list
+        """
+        rm = self._memberships()
+        return self._distinct_roles(session.query(User.identifier, Role.title).
+                                    select_from(Role).
+                                    join(rm, Role.pk_id == rm.c.role_id).
+                                    join(User, rm.c.user_id == User.pk_id).
+                                    filter(User.identifier.in_(identifier_s)))
+
+    def _permitted_clause(self, session, identifier, domain, action, resource):
+        """
+        An EXISTS of the permissions of a user that imply a permission, as
+        defined by _implies.  The database stops at the first such permission.
+        """
+        query = (self._join_permission_names(self._join_permissions(session.query(User.pk_id))).
+                 filter(User.identifier == identifier,
+                        _implies(domain, action, resource)))
+        return query.exists()
+
+    def _join_permission_names(self, query):
+        return (query.
+                outerjoin(Domain, Permission.domain_id == Domain.pk_id).
+                outerjoin(Action, Permission.action_id == Action.pk_id).
+                outerjoin(Resource, Permission.resource_id == Resource.pk_id))
+
+    def _implying_permission_ids(self, session, domain, action, resource):
+        return (self._join_permission_names(session.query(Permission.pk_id)).
+                filter(_implies(domain, action, resource)))
+
+    def _get_permitted_roles_query(self, session, domain, action, resource):
+        """
+        The roles granted a permission that implies a permission, together
+        with, with role_hierarchy, their descendants, which inherit it
+        """
+        rp, rc = role_permission_table, role_closure_table
+        role_ids = (session.query(rp.c.role_id).
+                    filter(rp.c.permission_id.in_(
+                        self._implying_permission_ids(session, domain, action, resource))))
+        if self.role_hierarchy:
+            role_ids = role_ids.union(session.query(rc.c.descendant_id).
+                                      filter(rc.c.ancestor_id.in_(role_ids)))
+        return (session.query(Role.title).
+                filter(Role.pk_id.in_(role_ids)).
+                order_by(Role.title))
+
+    def _get_permitted_users_query(self, session, domain, action, resource, after, limit):
+        """
+        A keyset page of the users that are permitted a permission, in pk_id
+        order:  the first limit of the users after the pk_id after
+        """
+        permission_ids = self._implying_permission_ids(session, domain, action, resource)
+        if self.effective_permissions:
+            uep = user_effective_permission_table
+            user_id = uep.c.user_id
+            grants = select([user_id]).where(uep.c.permission_id.in_(permission_ids))
+        else:
+            rm, rp = self._memberships(), role_permission_table
+            user_id = rm.c.user_id
+            grants = (select([user_id]).
+                      where(rm.c.role_id.in_(select([rp.c.role_id]).
+                                             where(rp.c.permission_id.in_(permission_ids)))))
+
+        if after is not None:
+            grants = grants.where(user_id > after)
+        page = grants.distinct().order_by(user_id).limit(limit).alias('page')
+
+        return (session.query(User.pk_id, User.identifier).
+                join(page, page.c.user_id == User.pk_id).
+                order_by(User.pk_id))
+
+    def _get_permitted_query(self, session, identifier):
+        return session.query(self._permitted_clause(session, identifier,
+                                                    bindparam('domain'),
+                                                    bindparam('action'),
+                                                    bindparam('resource')))
+
+    def _get_permitted_multi_query(self, session, identifier, count):
+        """
+        A single row of one EXISTS per permission, of count permissions bound
+        as domain_<n>, action_<n> and resource_<n> by _permitted_chunks
+        """
+        return session.query(*[self._permitted_clause(session, identifier,
+                                                      bindparam('domain_{0}'.format(n)),
+                                                      bindparam('action_{0}'.format(n)),
+                                                      bindparam('resource_{0}'.format(n)))
+                               for n in range(count)])
+
+    def _permitted_chunks(self, permission_s):
+        """
+        Splits the permissions of is_permitted_multi so that no statement
+        binds more than multi_chunk_size parameters:  the identifier, and a
+        domain, action and resource per permission
+
+        :returns: a generator of (permissions, params) tuples
+        """
+        chunk_size = max(1, (self.multi_chunk_size - 1) // 3)
+        for chunk in _chunked(list(permission_s), chunk_size):
+            params = {}
+            for n, (domain, action, resource) in enumerate(chunk):
+                params['domain_{0}'.format(n)] = domain
+                params['action_{0}'.format(n)] = action
+                params['resource_{0}'.format(n)] = resource
+            yield chunk, params
 
     def _get_credential_query(self, session, identifier):
         return (session.query(CredentialType.title, Credential.credential).
@@ -171,6 +932,114 @@ class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
                 join(User, Credential.user_id == User.pk_id).
                 filter(User.identifier == identifier))
 
+    def _get_authc_query(self, session, identifier):
+        """
+        Fuses the user and credential lookups into a single, column-only
+        statement so that authentication costs one round trip:
+
+        select user.account_lock_millis, user.phone_number,
+               credential_type.title, credential.credential
+          from user
+          join credential on user.pk_id = credential.user_id
+          join credential_type on credential_type.pk_id = credential.credential_type_id
+         where user.identifier = :identifier
+        """
+        return (session.query(User.account_lock_millis,
+                              User.phone_number,
+                              CredentialType.title,
+                              Credential.credential).
+                select_from(User).
+                join(Credential, User.pk_id == Credential.user_id).
+                join(CredentialType, CredentialType.pk_id == Credential.credential_type_id).
+                filter(User.identifier == identifier))
+
+    def _get_authc_multi_query(self, session, identifier_s):
+        """
+        :type identifier_s: list
+        """
+        return (session.query(User.identifier,
+                              User.account_lock_millis,
+                              User.phone_number,
+                              CredentialType.title,
+                              Credential.credential).
+                select_from(User).
+                join(Credential, User.pk_id == Credential.user_id).
+                join(CredentialType, CredentialType.pk_id == Credential.credential_type_id).
+                filter(User.identifier.in_(identifier_s)))
+
+    def _get_lock_query(self, session, identifier):
+        return (session.query(User.account_lock_millis).
+                filter(User.identifier == identifier))
+
+    def _get_failed_attempts_query(self, session, identifier):
+        """
+        The most recent failed attempts of a user since a time, a range of
+        ix_failed_attempt_user_id:  (credential type, attempt_millis)
+        """
+        return (session.query(CredentialType.title, FailedAttempt.attempt_millis).
+                select_from(User).
+                join(FailedAttempt, User.pk_id == FailedAttempt.user_id).
+                join(CredentialType, CredentialType.pk_id == FailedAttempt.credential_type_id).
+                filter(User.identifier == identifier,
+                       FailedAttempt.attempt_millis >= bindparam('since')).
+                order_by(FailedAttempt.attempt_millis.desc()).
+                limit(self.failed_attempt_limit))
+
+    def _get_failed_attempts_multi_query(self, session, identifier_s):
+        """
+        The failed attempts of many users since a time.  Unlike
+        _get_failed_attempts_query, the rows aren't limited per user, which
+        _add_failed_attempts does instead.
+
+        :type identifier_s: list
+        """
+        return (session.query(User.identifier, CredentialType.title,
+                              FailedAttempt.attempt_millis).
+                select_from(User).
+                join(FailedAttempt, User.pk_id == FailedAttempt.user_id).
+                join(CredentialType, CredentialType.pk_id == FailedAttempt.credential_type_id).
+                filter(User.identifier.in_(identifier_s),
+                       FailedAttempt.attempt_millis >= bindparam('since')))
+
+    def _failed_attempts_since(self):
+        return int(time.time() * 1000) - self.failed_attempt_window
+
+    def _add_failed_attempts(self, authc_info, identifier, rows):
+        """
+        Populates the failed_attempts of authc_info, or of an account of
+        get_account, from the (credential type, attempt_millis) rows of
+        _get_failed_attempts_query and the attempts pending in the buffer
+        """
+        attempts = self.failed_attempts.pending(identifier)
+        for credential_type, attempt_millis in rows:
+            attempts.setdefault(credential_type, []).append(attempt_millis)
+
+        since = self._failed_attempts_since()
+        for credential_type, attempt_millis_s in attempts.items():
+            if credential_type in authc_info['authc_info']:
+                recent = sorted(set(millis for millis in attempt_millis_s if millis >= since))
+                authc_info['authc_info'][credential_type]['failed_attempts'] = \
+                    recent[-self.failed_attempt_limit:]
+        return authc_info
+
+    def _build_authc_info(self, rows):
+        """
+        :param rows: (account_lock_millis, phone_number, cred_type, cred_value)
+                     rows for a single user, as returned by _get_authc_query
+        :returns: a dict of account attributes, or None if there are no rows
+        """
+        if not rows:
+            return None
+
+        account_locked, phone_number = rows[0][0], rows[0][1]
+        authc_info = {cred_type: {'credential': cred_value, 'failed_attempts': []}
+                      for _, _, cred_type, cred_value in rows}
+
+        if 'totp_key' in authc_info:
+            authc_info['totp_key']['2fa_info'] = {'phone_number': phone_number}
+
+        return dict(account_locked=account_locked, authc_info=authc_info)
+
     @session_context
     def get_authc_info(self, identifier, session=None):
         """
@@ -180,32 +1049,220 @@ class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
 
         :returns: a dict of account attributes
         """
-        user = self._get_user_query(session, identifier).first()
+        rows = list(self._query(session, self._get_authc_query, identifier))
+        authc_info = self._build_authc_info(rows)
+        if authc_info is None or self.failed_attempts is None:
+            return authc_info
+
+        rows = self._query(session, self._get_failed_attempts_query, identifier,
+                           since=self._failed_attempts_since())
+        return self._add_failed_attempts(authc_info, identifier, rows)
 
-        creds = self._get_credential_query(session, identifier).all()
-        if not creds:
+    @session_context
+    def get_authz_permissions(self, identifier, session=None):
+        try:
+            if self._aggregates_permissions(session):
+                return self._permissions_from_aggregate(
+                    self._query(session, self._get_permissions_query, identifier))
+            return self._permissions_from_rows(
+                self._query(session, self._get_permission_rows_query, identifier))
+        except AttributeError:
             return None
-        authc_info = {cred_type: {'credential': cred_value, 'failed_attempts': []}
-                      for cred_type, cred_value in creds}
 
-        if 'totp_key' in authc_info:
-            authc_info['totp_key']['2fa_info'] = {'phone_number': user.phone_number}
+    @session_context
+    def get_authz_roles(self, identifier, session=None):
+        try:
+            return [r.title for r in self._query(session, self._get_roles_query, identifier)]
+        except AttributeError:
+            return None
 
-        return dict(account_locked=user.account_lock_millis, authc_info=authc_info)
+    @session_context
+    def get_authc_info_multi(self, identifier_s, session=None):
+        """
+        Batched get_authc_info, obtaining the authc info of many accounts
+        using a handful of chunked IN queries.
+
+        :type identifier_s: list
+        :returns: a dict of identifier to account attributes (or None)
+        """
+        identifier_s = _unique(identifier_s)
+        rows = collections.defaultdict(list)
+        for chunk in _chunked(identifier_s, self.multi_chunk_size):
+            for identifier, *row in self._query(session, self._get_authc_multi_query, chunk):
+                rows[identifier].append(row)
+
+        result = {identifier: self._build_authc_info(rows.get(identifier))
+                  for identifier in identifier_s}
+        if self.failed_attempts is None:
+            return result
+
+        found = [identifier for identifier in identifier_s if result[identifier] is not None]
+        attempts = collections.defaultdict(list)
+        for chunk in _chunked(found, self.multi_chunk_size):
+            for identifier, *row in self._query(session, self._get_failed_attempts_multi_query,
+                                                chunk, since=self._failed_attempts_since()):
+                attempts[identifier].append(row)
+
+        for identifier in found:
+            self._add_failed_attempts(result[identifier], identifier, attempts[identifier])
+        return result
 
     @session_context
-    def get_authz_permissions(self, identifier, session=None):
+    def get_authz_permissions_multi(self, identifier_s, session=None):
+        """
+        :type identifier_s: list
+        :returns: a dict of identifier to domain-keyed permissions
+        """
+        identifier_s = _unique(identifier_s)
+        result = {identifier: {} for identifier in identifier_s}
         try:
-            return dict(self._get_permissions_query(session, identifier).all())
-        except (AttributeError, TypeError):
+            aggregates = self._aggregates_permissions(session)
+            builder = (self._get_permissions_multi_query if aggregates else
+                       self._get_permission_rows_multi_query)
+            rows = collections.defaultdict(list)
+            for chunk in _chunked(identifier_s, self.multi_chunk_size):
+                for identifier, *row in self._query(session, builder, chunk):
+                    rows[identifier].append(row)
+        except AttributeError:
             return None
 
+        build = (self._permissions_from_aggregate if aggregates else
+                 self._permissions_from_rows)
+        result.update((identifier, build(perms))
+                      for identifier, perms in rows.items())
+        return result
+
     @session_context
-    def get_authz_roles(self, identifier, session=None):
+    def get_authz_roles_multi(self, identifier_s, session=None):
+        """
+        :type identifier_s: list
+        :returns: a dict of identifier to a list of role titles
+        """
+        identifier_s = _unique(identifier_s)
+        result = {identifier: [] for identifier in identifier_s}
         try:
-            return [r.title for r in self._get_roles_query(session, identifier).all()]
-        except (AttributeError, TypeError):
+            for chunk in _chunked(identifier_s, self.multi_chunk_size):
+                for identifier, title in self._query(session, self._get_roles_multi_query, chunk):
+                    result[identifier].append(title)
+        except AttributeError:
             return None
+        return result
+
+    @session_context
+    def is_permitted(self, identifier, domain, action='*', resource='*', session=None):
+        """
+        Evaluates a single permission check in the database, rather than
+        obtaining every permission of the user, for users with very large
+        sets of grants
+
+        :param domain: the domain name, or '*'
+        :param action: the action name, or '*'
+        :param resource: the resource name, or '*'
+
+        :returns: True if a permission of the user implies the permission
+        """
+        return bool(self._query(session, self._get_permitted_query, identifier,
+                                domain=domain, action=action, resource=resource).scalar())
+
+    @session_context
+    def is_permitted_multi(self, identifier, permission_s, session=None):
+        """
+        :param permission_s: (domain, action, resource) tuples, as accepted
+                             by is_permitted
+        :type permission_s: list
+
+        :returns: a list of whether each permission is implied, in order
+        """
+        result = []
+        for chunk, params in self._permitted_chunks(permission_s):
+            row = self._query(session, self._get_permitted_multi_query, identifier,
+                              shape=(len(chunk),), **params).first()
+            result.extend(bool(permitted) for permitted in row)
+        return result
+
+    @session_context
+    def get_permitted_roles(self, domain, action='*', resource='*', session=None):
+        """
+        Obtains the roles that grant a permission, or a permission that
+        implies it, including with role_hierarchy the roles that inherit it
+
+        :returns: a list of role titles
+        """
+        query = self._get_permitted_roles_query(session, domain, action, resource)
+        return [title for title, in query]
+
+    def iter_permitted_users(self, domain, action='*', resource='*', page_size=1000):
+        """
+        Streams the identifiers of the users that are permitted a permission,
+        as is_permitted would evaluate it for each, such as for an audit:
+
+            for identifier in account_store.iter_permitted_users('money', 'withdrawal'):
+                ...
+
+        Users are read in keyset pages of page_size, ordered by pk_id, each
+        page through its own short-lived session (or the session_scope's), so
+        that memory stays flat and no transaction is held open between pages.
+
+        :returns: a generator of identifiers
+        """
+        after = None
+        while True:
+            session, owned = self._obtain_session('iter_permitted_users')
+            try:
+                rows = self._get_permitted_users_query(session, domain, action, resource,
+                                                       after, page_size).all()
+            finally:
+                if owned:
+                    session.close()
+
+            for _, identifier in rows:
+                yield identifier
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    @session_context
+    def is_account_locked(self, identifier, session=None):
+        """
+        Obtains an account's lock state alone, through the unique index of
+        user.identifier, rather than its full authc info
+
+        :returns: True if the account is locked, False if it isn't, or None
+                  if there is no such account
+        """
+        row = self._query(session, self._get_lock_query, identifier).first()
+        return None if row is None else row[0] is not None
+
+    def _lock_statements(self, identifier_s, locked_time):
+        """
+        :returns: one update of account_lock_millis per chunk of identifier_s
+        """
+        user = User.__table__
+        return [user.update().
+                where(user.c.identifier.in_(chunk)).
+                values(account_lock_millis=locked_time)
+                for chunk in _chunked(_unique(identifier_s), self.multi_chunk_size)]
+
+    @session_context
+    def lock_accounts(self, identifier_s, locked_time, session=None):
+        """
+        Locks many accounts in a single transaction, such as while under a
+        credential-stuffing attack
+
+        :type identifier_s: iterable
+        """
+        identifier_s = _unique(identifier_s)  # may be a generator
+        self._execute_statements(session, self._lock_statements(identifier_s, locked_time))
+        self._wrote_lock_state(identifier_s)
+
+    @session_context
+    def unlock_accounts(self, identifier_s, session=None):
+        """
+        :type identifier_s: iterable
+        """
+        identifier_s = _unique(identifier_s)  # may be a generator
+        self._execute_statements(session, self._lock_statements(identifier_s, None))
+        self._wrote_lock_state(identifier_s)
 
     @session_context
     def lock_account(self, identifier, locked_time, session=None):
@@ -214,6 +1271,7 @@ class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
             update({User.account_lock_millis: locked_time})
 
         session.commit()
+        self._wrote_lock_state([identifier])
 
     @session_context
     def unlock_account(self, identifier, session=None):
@@ -222,42 +1280,663 @@ class AlchemyAccountStore(account_abcs.CredentialsAccountStore,
             update({User.account_lock_millis: None})
 
         session.commit()
+        self._wrote_lock_state([identifier])
+
+    # --------------------------------------------------------------------------
+    # Failed Attempts
+    # --------------------------------------------------------------------------
+
+    def record_failed_attempt(self, identifier, credential_type='password',
+                              attempt_millis=None):
+        """
+        Records a failed authentication attempt in the failed_attempts buffer,
+        from which it is written to the failed_attempt table in a later batch
+        by a background thread, rather than by the caller
+
+        :param attempt_millis: the time of the attempt, in milliseconds since
+                               the epoch, defaulting to now
+        """
+        if self.failed_attempts is None:
+            msg = 'record_failed_attempt requires a store created with failed_attempts'
+            raise ValueError(msg)
+
+        if attempt_millis is None:
+            attempt_millis = int(time.time() * 1000)
+
+        if self._flush_thread is None:
+            self._start_flush_thread()
+
+        if self.failed_attempts.record(identifier, credential_type, attempt_millis):
+            self._flush_thread.wake.set()
+
+    def _start_flush_thread(self):
+        with self._flush_lock:
+            if self._flush_thread is None:
+                thread = FlushThread(self.failed_attempts, self.flush_failed_attempts)
+                thread.start()
+                atexit.register(self.close)
+                self._flush_thread = thread
+
+    def _failed_attempt_rows(self, records, user_ids, credential_type_ids):
+        """
+        :returns: the failed_attempt rows of drained records, skipping those
+                  of unknown identifiers and credential types
+        """
+        return [dict(user_id=user_ids[identifier],
+                     credential_type_id=credential_type_ids[credential_type],
+                     attempt_millis=attempt_millis)
+                for identifier, credential_type, attempt_millis in records
+                if identifier in user_ids and credential_type in credential_type_ids]
+
+    @session_context
+    def flush_failed_attempts(self, session=None):
+        """
+        Writes the pending failed attempts in a single transaction.  Attempts
+        are returned to the buffer if they can't be written.
+
+        :returns: the number of attempts written
+        """
+        records = self.failed_attempts.drain()
+        if not records:
+            return 0
+
+        try:
+            user_ids = {}
+            identifier_s = _unique(identifier for identifier, _, _ in records)
+            for chunk in _chunked(identifier_s, self.multi_chunk_size):
+                user_ids.update(session.query(User.identifier, User.pk_id).
+                                filter(User.identifier.in_(chunk)))
+            credential_type_ids = dict(
+                session.query(CredentialType.title, CredentialType.pk_id).
+                filter(CredentialType.title.in_({record[1] for record in records})))
+
+            rows = self._failed_attempt_rows(records, user_ids, credential_type_ids)
+            if rows:
+                session.execute(FailedAttempt.__table__.insert(), rows)
+            session.commit()
+        except Exception:
+            session.rollback()
+            self.failed_attempts.requeue(records)
+            raise
+        return len(rows)
+
+    @session_context
+    def prune_failed_attempts(self, before_millis=None, session=None):
+        """
+        Deletes the failed attempts made before a time, defaulting to those
+        older than the failed_attempt_window, which get_authc_info no longer
+        returns
+        """
+        if before_millis is None:
+            before_millis = self._failed_attempts_since()
+        session.query(FailedAttempt).\
+            filter(FailedAttempt.attempt_millis < before_millis).\
+            delete(synchronize_session=False)
+        session.commit()
+
+    def close(self):
+        """
+        Stops the background flushing of failed attempts, after a final flush
+        """
+        thread, self._flush_thread = self._flush_thread, None
+        if thread is not None:
+            thread.stop()
+            thread.join()
+            self.flush_failed_attempts()
+
+    # --------------------------------------------------------------------------
+    # Role Administration
+    # --------------------------------------------------------------------------
+
+    def _get_authz_version_query(self, session):
+        return (session.query(authz_version_table.c.version).
+                filter(authz_version_table.c.pk_id == 1))
+
+    def _get_authz_versions_since_query(self, session, version):
+        uav = user_authz_version_table
+        return (session.query(User.identifier, uav.c.version).
+                join(uav, uav.c.user_id == User.pk_id).
+                filter(uav.c.version > version))
+
+    @session_context
+    def get_authz_versions_since(self, version, session=None):
+        """
+        Obtains the users whose roles or permissions have changed, through a
+        store created with track_versions=True, since a version.  A cache of
+        authorization info can so be long-lived, polling for the identifiers
+        to invalidate:
+
+            version, changes = account_store.get_authz_versions_since(0)
+            ...
+            version, changes = account_store.get_authz_versions_since(version)
+
+        :param version: the version returned by the previous call, or 0
+        :type version: int
+
+        :returns: a (version, changes) tuple of the current version, to be
+                  passed to the next call, and a dict of the identifier of
+                  each changed user to the version of its latest change
+        """
+        current = self._get_authz_version_query(session).scalar() or 0
+        changes = dict(self._get_authz_versions_since_query(session, version))
+        return max([current] + list(changes.values())), changes
+
+    def _add_role_member_statements(self, identifier, role_title):
+        """
+        Each of the role administration builders returns the insert and delete
+        statements that make a change, including the incremental maintenance
+        of user_effective_permission when it is in use (with role_hierarchy,
+        the rows of the affected users are rebuilt instead) and the version
+        stamps of the affected users when they are tracked.  Unknown
+        identifiers and role titles affect no rows.
+        """
+        rm, rp = role_membership_table, role_permission_table
+        uep = user_effective_permission_table
+
+        statements = [
+            rm.insert().from_select(
+                ['role_id', 'user_id'],
+                select([Role.pk_id, User.pk_id]).
+                select_from(User.__table__.join(Role, Role.title == role_title)).
+                where(and_(User.identifier == identifier,
+                           ~exists().where(and_(rm.c.role_id == Role.pk_id,
+                                                rm.c.user_id == User.pk_id)))))]
+
+        if self.effective_permissions and not self.role_hierarchy:
+            statements.append(uep.insert().from_select(
+                ['user_id', 'permission_id'],
+                select([User.pk_id, rp.c.permission_id]).
+                select_from(rp.join(Role, Role.pk_id == rp.c.role_id).
+                            join(User, User.identifier == identifier)).
+                where(and_(Role.title == role_title,
+                           ~exists().where(and_(uep.c.user_id == User.pk_id,
+                                                uep.c.permission_id == rp.c.permission_id)))).
+                distinct()))
+
+        statements.extend(self._users_changed_statements(
+            select([User.pk_id]).where(User.identifier == identifier)))
+
+        return statements
+
+    def _remove_role_member_statements(self, identifier, role_title):
+        rm, rp = role_membership_table, role_permission_table
+        uep = user_effective_permission_table
+
+        user_id = select([User.pk_id]).where(User.identifier == identifier)
+        role_ids = select([Role.pk_id]).where(Role.title == role_title)
+
+        statements = [
+            rm.delete().where(and_(rm.c.user_id.in_(user_id),
+                                   rm.c.role_id.in_(role_ids)))]
+
+        if self.effective_permissions and not self.role_hierarchy:
+            # the user keeps those permissions granted through its other roles
+            statements.append(uep.delete().where(and_(
+                uep.c.user_id.in_(user_id),
+                uep.c.permission_id.in_(select([rp.c.permission_id]).
+                                        where(rp.c.role_id.in_(role_ids))),
+                ~exists().select_from(rm.join(rp, rm.c.role_id == rp.c.role_id)).
+                where(and_(rm.c.user_id == uep.c.user_id,
+                           rp.c.permission_id == uep.c.permission_id)))))
+
+        statements.extend(self._users_changed_statements(user_id))
+
+        return statements
+
+    def _grant_role_permission_statements(self, role_title, permission_id):
+        rm, rp = role_membership_table, role_permission_table
+        uep = user_effective_permission_table
+
+        statements = [
+            rp.insert().from_select(
+                ['role_id', 'permission_id'],
+                select([Role.pk_id, literal(permission_id)]).
+                where(and_(Role.title == role_title,
+                           ~exists().where(and_(rp.c.role_id == Role.pk_id,
+                                                rp.c.permission_id == permission_id)))))]
+
+        if self.effective_permissions and not self.role_hierarchy:
+            statements.append(uep.insert().from_select(
+                ['user_id', 'permission_id'],
+                select([rm.c.user_id, literal(permission_id)]).
+                select_from(rm.join(Role, Role.pk_id == rm.c.role_id)).
+                where(and_(Role.title == role_title,
+                           ~exists().where(and_(uep.c.user_id == rm.c.user_id,
+                                                uep.c.permission_id == permission_id)))).
+                distinct()))
+
+        statements.extend(self._users_changed_statements(self._role_members(role_title)))
+
+        return statements
+
+    def _revoke_role_permission_statements(self, role_title, permission_id):
+        rm, rp = role_membership_table, role_permission_table
+        uep = user_effective_permission_table
+
+        role_ids = select([Role.pk_id]).where(Role.title == role_title)
+
+        statements = [
+            rp.delete().where(and_(rp.c.role_id.in_(role_ids),
+                                   rp.c.permission_id == permission_id))]
+
+        if self.effective_permissions and not self.role_hierarchy:
+            # members keep the permission when another of their roles grants it
+            statements.append(uep.delete().where(and_(
+                uep.c.permission_id == permission_id,
+                uep.c.user_id.in_(select([rm.c.user_id]).where(rm.c.role_id.in_(role_ids))),
+                ~exists().select_from(rm.join(rp, rm.c.role_id == rp.c.role_id)).
+                where(and_(rm.c.user_id == uep.c.user_id,
+                           rp.c.permission_id == permission_id)))))
+
+        statements.extend(self._users_changed_statements(self._role_members(role_title)))
+
+        return statements
+
+    def _role_members(self, role_title):
+        """
+        :returns: a select of the pk_ids of the members of a role, including,
+                  with role_hierarchy, the members of its descendants
+        """
+        rm = self._memberships()
+        return (select([rm.c.user_id]).
+                where(rm.c.role_id.in_(select([Role.pk_id]).where(Role.title == role_title))))
+
+    def _users_changed_statements(self, user_ids):
+        """
+        :param user_ids: a select of the pk_ids of the users whose roles or
+                         permissions change
+        :returns: the statements that rebuild the user_effective_permission
+                  rows of the users when they aren't maintained incrementally,
+                  and that stamp the users with a new version when tracked
+        """
+        statements = []
+        if self.effective_permissions and self.role_hierarchy:
+            statements.extend(self._rebuild_effective_permissions_statements(user_ids))
+        if self.track_versions:
+            statements.extend(self._stamp_versions_statements(user_ids))
+        return statements
+
+    def _stamp_versions_statements(self, user_ids):
+        """
+        Advances the authz_version and stamps the users of user_ids with it.
+        Updating the single authz_version row serializes the changes, so that
+        versions are committed in the order in which they are issued.
+
+        :raises RuntimeError: if the authz_version row is missing, as then
+                              nothing would be stamped
+
+        :param user_ids: a select of the pk_ids of the users whose roles or
+                         permissions change
+        """
+        av, uav = authz_version_table, user_authz_version_table
+
+        return [av.update().where(av.c.pk_id == 1).values(version=av.c.version + 1).
+                execution_options(requires_row=True),
+                uav.delete().where(uav.c.user_id.in_(user_ids)),
+                uav.insert().from_select(
+                    ['user_id', 'version'],
+                    select([User.pk_id, av.c.version]).
+                    select_from(User.__table__.join(av, av.c.pk_id == 1)).
+                    where(User.pk_id.in_(user_ids)))]
+
+    def _refresh_effective_permissions_statements(self, identifier=None):
+        if identifier is None:
+            return self._rebuild_effective_permissions_statements()
+        return self._rebuild_effective_permissions_statements(
+            select([User.pk_id]).where(User.identifier == identifier))
+
+    def _rebuild_effective_permissions_statements(self, user_ids=None):
+        """
+        :param user_ids: a select of the pk_ids of the users whose rows are
+                         rebuilt, or None for every user
+        """
+        rm, rp = self._memberships(), role_permission_table
+        uep = user_effective_permission_table
+
+        grants = (select([rm.c.user_id, rp.c.permission_id]).
+                  select_from(rm.join(rp, rm.c.role_id == rp.c.role_id)).
+                  distinct())
+
+        if user_ids is None:
+            return [uep.delete(),
+                    uep.insert().from_select(['user_id', 'permission_id'], grants)]
+
+        return [uep.delete().where(uep.c.user_id.in_(user_ids)),
+                uep.insert().from_select(['user_id', 'permission_id'],
+                                         grants.where(rm.c.user_id.in_(user_ids)))]
+
+    def _execute_statements(self, session, statements):
+        for statement in statements:
+            _check_required_row(statement, session.execute(statement))
+        session.commit()
+
+    @session_context
+    def add_role_member(self, identifier, role_title, session=None):
+        self._execute_statements(
+            session, self._add_role_member_statements(identifier, role_title))
+
+    @session_context
+    def remove_role_member(self, identifier, role_title, session=None):
+        self._execute_statements(
+            session, self._remove_role_member_statements(identifier, role_title))
+
+    @session_context
+    def grant_role_permission(self, role_title, permission_id, session=None):
+        """
+        :param permission_id: the pk_id of the Permission
+        """
+        self._execute_statements(
+            session, self._grant_role_permission_statements(role_title, permission_id))
+
+    @session_context
+    def revoke_role_permission(self, role_title, permission_id, session=None):
+        """
+        :param permission_id: the pk_id of the Permission
+        """
+        self._execute_statements(
+            session, self._revoke_role_permission_statements(role_title, permission_id))
+
+    @session_context
+    def refresh_effective_permissions(self, identifier=None, session=None):
+        """
+        Rebuilds user_effective_permission from role memberships and role
+        permissions, for one user or for all users.  This populates the table
+        initially and repairs it after changes made outside of this store.
+        """
+        self._execute_statements(
+            session, self._refresh_effective_permissions_statements(identifier))
+
+    def _change_role_parent(self, session, role_title, parent_title, add):
+        """
+        Adds or removes a role_hierarchy edge, maintaining role_closure:  an
+        added edge relates each of the parent's ancestors, and the parent, to
+        each of the role's descendants, and the role, whereas a removed edge
+        is followed by rebuilding the closure, as the pairs that remain
+        reachable through other paths can't be told apart otherwise.
+
+        :returns: the statements that follow the change for the members of
+                  the role and its descendants, whose inherited roles change
+        """
+        rh, rc = role_hierarchy_table, role_closure_table
+
+        role_ids = dict(session.query(Role.title, Role.pk_id).
+                        filter(Role.title.in_([role_title, parent_title])))
+        if role_title not in role_ids or parent_title not in role_ids:
+            return []
+
+        role_id, parent_id = role_ids[role_title], role_ids[parent_title]
+        edge = and_(rh.c.parent_role_id == parent_id, rh.c.child_role_id == role_id)
+
+        if not add:
+            session.execute(rh.delete().where(edge))
+            self._rebuild_role_closure(session)
+            return self._users_changed_statements(self._role_members(role_title))
+
+        if role_id == parent_id or session.query(exists().where(
+                and_(rc.c.ancestor_id == role_id, rc.c.descendant_id == parent_id))).scalar():
+            msg = ('{0} cannot inherit from {1}, which is the role itself or one of its '
+                   'descendants'.format(role_title, parent_title))
+            raise ValueError(msg)
+
+        if session.query(exists().where(edge)).scalar():
+            return []
+        session.execute(rh.insert().values(parent_role_id=parent_id, child_role_id=role_id))
+
+        ancestor_s = {parent_id}.union(
+            ancestor_id for ancestor_id, in
+            session.query(rc.c.ancestor_id).filter(rc.c.descendant_id == parent_id))
+        descendant_s = {role_id}.union(
+            descendant_id for descendant_id, in
+            session.query(rc.c.descendant_id).filter(rc.c.ancestor_id == role_id))
+        existing = set(session.query(rc.c.ancestor_id, rc.c.descendant_id).
+                       filter(rc.c.ancestor_id.in_(ancestor_s),
+                              rc.c.descendant_id.in_(descendant_s)))
+
+        rows = [dict(ancestor_id=ancestor_id, descendant_id=descendant_id)
+                for ancestor_id in ancestor_s
+                for descendant_id in descendant_s
+                if (ancestor_id, descendant_id) not in existing]
+        if rows:
+            session.execute(rc.insert(), rows)
+
+        return self._users_changed_statements(self._role_members(role_title))
+
+    def _rebuild_role_closure(self, session):
+        rh, rc = role_hierarchy_table, role_closure_table
+
+        edges = session.query(rh.c.parent_role_id, rh.c.child_role_id).all()
+        session.execute(rc.delete())
+        rows = [dict(ancestor_id=ancestor_id, descendant_id=descendant_id)
+                for ancestor_id, descendant_id in sorted(_role_closure(edges))]
+        if rows:
+            session.execute(rc.insert(), rows)
+
+    @session_context
+    def add_role_parent(self, role_title, parent_title, session=None):
+        """
+        Makes a role the child of a parent role, inheriting its permissions,
+        for the stores created with role_hierarchy.  A role may have many
+        parents.
+
+        :raises ValueError: if the parent is the role or one of its descendants
+        """
+        self._execute_statements(
+            session, self._change_role_parent(session, role_title, parent_title, add=True))
+
+    @session_context
+    def remove_role_parent(self, role_title, parent_title, session=None):
+        self._execute_statements(
+            session, self._change_role_parent(session, role_title, parent_title, add=False))
+
+    @session_context
+    def refresh_role_closure(self, session=None):
+        """
+        Rebuilds role_closure from role_hierarchy, repairing it after changes
+        made outside of this store
+        """
+        self._rebuild_role_closure(session)
+        session.commit()
+
+    def _get_account_query(self, session, identifier):
+        """
+        Collects lock state, credentials, roles and permissions for one user
+        as a single UNION ALL statement of (kind, key, value, extra) rows:
+
+            ('account', account_lock_millis, phone_number, null)
+            ('credential', credential_type.title, credential.credential, null)
+            ('role', role.title, null, null)
+
+        followed by, when the database aggregates permissions:
+            ('permission', domain, permissions, null)
+        or otherwise:
+            ('permission', domain, action, resource)
+        """
+        kind, empty = _kind, _empty
+
+        account = (session.query(kind('account'),
+                                 cast(User.account_lock_millis, Text).label('key'),
+                                 cast(User.phone_number, Text).label('value'),
+                                 empty().label('extra')).
+                   filter(User.identifier == identifier))
+
+        credentials = (session.query(kind('credential'),
+                                     CredentialType.title,
+                                     Credential.credential,
+                                     empty()).
+                       select_from(User).
+                       join(Credential, User.pk_id == Credential.user_id).
+                       join(CredentialType, CredentialType.pk_id == Credential.credential_type_id).
+                       filter(User.identifier == identifier))
+
+        rm = self._memberships()
+        roles = self._distinct_roles(session.query(kind('role'),
+                                                   Role.title,
+                                                   empty(),
+                                                   empty()).
+                                     select_from(Role).
+                                     join(rm, Role.pk_id == rm.c.role_id).
+                                     join(User, rm.c.user_id == User.pk_id).
+                                     filter(User.identifier == identifier))
+
+        if self._aggregates_permissions(session):
+            perms = self._get_permissions_query(session, identifier).subquery()
+            permissions = (session.query(kind('permission'), *(list(perms.c) + [empty()])).
+                           select_from(perms))
+        else:
+            perms = self._get_permission_rows_query(session, identifier).subquery()
+            permissions = (session.query(kind('permission'), *perms.c).
+                           select_from(perms))
+
+        return account.union_all(credentials, roles, permissions)
+
+    @session_context
+    def get_account(self, identifier, session=None):
+        """
+        get_account performs the most comprehensive collection of information
+        from the database, including credentials AND authorization information,
+        using a single round trip
+
+        :param identifier:  the request object's identifier
+        :returns: dict, or None if the account doesn't exist
+
+        CAUTION
+        --------
+        Without get_or_create_multi dogpile protection in the caching layer,
+        you run the risk of concurrently calling the most expensive creational
+        process.  Cache its results accordingly.
+        """
+        rows = self._query(session, self._get_account_query, identifier)
+        account = self._build_account(session, identifier, rows)
+        if account is None or self.failed_attempts is None:
+            return account
+
+        rows = self._query(session, self._get_failed_attempts_query, identifier,
+                           since=self._failed_attempts_since())
+        return self._add_failed_attempts(account, identifier, rows)
+
+    def _get_authz_export_query(self, session):
+        """
+        The roles and permissions of every user as a single UNION ALL of
+        (identifier, kind, key, value, extra) rows, ordered by identifier so
+        that each user's rows are contiguous:
+
+            (identifier, 'account', null, null, null)
+            (identifier, 'role', role.title, null, null)
+            (identifier, 'permission', domain, action, resource)
+        """
+        kind, empty = _kind, _empty
+
+        account = session.query(User.identifier,
+                                kind('account'),
+                                empty().label('key'),
+                                empty().label('value'),
+                                empty().label('extra'))
+
+        rm = self._memberships()
+        roles = self._distinct_roles(session.query(User.identifier,
+                                                   kind('role'),
+                                                   Role.title.label('key'),
+                                                   empty().label('value'),
+                                                   empty().label('extra')).
+                                     select_from(Role).
+                                     join(rm, Role.pk_id == rm.c.role_id).
+                                     join(User, rm.c.user_id == User.pk_id))
+
+        perms = self._flat_permissions_query(session, true(), by_identifier=True).subquery()
+        permissions = session.query(perms.c.identifier, kind('permission'),
+                                    perms.c.domain, perms.c.action, perms.c.resource)
+
+        return account.union_all(roles, permissions).order_by(User.identifier)
+
+    def _build_authz_export(self, rows):
+        """
+        Groups the rows of _get_authz_export_query by user as they arrive
+
+        :returns: a generator of (identifier, authz_info) tuples
+        """
+        identifier, roles, perms = None, [], []
+        for row_identifier, kind, key, value, extra in rows:
+            if row_identifier != identifier:
+                if identifier is not None:
+                    yield identifier, dict(roles=roles,
+                                           permissions=self._permissions_from_rows(perms))
+                identifier, roles, perms = row_identifier, [], []
+            if kind == 'role':
+                roles.append(key)
+            elif kind == 'permission':
+                perms.append((key, value, extra))
+
+        if identifier is not None:
+            yield identifier, dict(roles=roles, permissions=self._permissions_from_rows(perms))
+
+    def iter_authz_info(self, yield_per=1000):
+        """
+        Exports the authorization info of every user, such as to warm a cache
+        after a deployment, in a single ordered scan that is streamed from a
+        server-side cursor (where the driver supports one) yield_per rows at a
+        time, so that memory stays bounded by the largest user:
+
+            for identifier, authz_info in account_store.iter_authz_info():
+                cache.set(identifier, authz_info)
+
+        :returns: a generator of (identifier, authz_info) tuples, where
+                  authz_info is a dict of roles and domain-grouped
+                  permissions, as with get_account
+        """
+        session, owned = self._obtain_session('iter_authz_info')
+        try:
+            statement = self._get_authz_export_query(session).statement
+            result = (session.connection().
+                      execution_options(stream_results=True).
+                      execute(statement))
+
+            def rows():
+                while True:
+                    chunk = result.fetchmany(yield_per)
+                    if not chunk:
+                        return
+                    yield from chunk
+
+            yield from self._build_authz_export(rows())
+        finally:
+            if owned:
+                session.close()
+
+    def _build_account(self, session, identifier, rows):
+        """
+        :param rows: the (kind, key, value, extra) rows of _get_account_query
+        :returns: dict, or None if there is no 'account' row
+        """
+        account = None
+        creds = []
+        roles = []
+        perms = []
+
+        for kind, key, value, extra in rows:
+            if kind == 'account':
+                account = (int(key) if key is not None else None, value)
+            elif kind == 'credential':
+                creds.append((key, value))
+            elif kind == 'role':
+                roles.append(key)
+            else:
+                perms.append((key, value, extra))
+
+        if account is None:
+            return None
+
+        if self._aggregates_permissions(session):
+            permissions = self._permissions_from_aggregate(
+                (domain, value) for domain, value, _ in perms)
+        else:
+            permissions = self._permissions_from_rows(perms)
+
+        account_locked, phone_number = account
+        authc_info = self._build_authc_info([(account_locked, phone_number,
+                                              cred_type, cred_value)
+                                             for cred_type, cred_value in creds])
 
-#    @session_context
-#    def get_account(self, identifier, session=None):
-#        """
-#        get_account performs the most comprehensive collection of information
-#        from the database, including credentials AND authorization information
-#
-#        :param identifier:  the request object's identifier
-#        :returns: dict
-#
-#        CAUTION
-#        --------
-#        This method was initially created as part of shiro porting but is
-#        not intended for v0.1.0 use due to lack of support for get_or_create_multi
-#        dogpile locking. If you would like to use get_account, you *should*
-#        implement an appropriate get_or_create_multi caching process (and submit
-#        the changes as pull requests to yosai!).  Without dogpile protection,
-#        you run the risk of concurrently calling the most expensive creational
-#        process
-#
-#        """
-#        cred = self.get_credential_query(session, identifier).scalar()
-#        credential = self.credential(cred)
-#
-#        roles = {self.role(r.title)
-#                 for r in self.get_roles_query(session, identifier).all()}
-#
-#        perms = self.get_permissions_query(session, identifier).all()
-#        permissions = {self.permission(permission=p.perm)
-#                       for p in perms}
-#
-#        authz_info = self.authz_info(roles=roles,
-#                                              permissions=permissions)
-#
-#        account = dict(account_id=identifier,
-#                          credentials=credential,
-#                          authz_info=authz_info)
-#
-#        return account
+        return dict(account_id=identifier,
+                    account_locked=account_locked,
+                    authc_info=authc_info['authc_info'] if authc_info else {},
+                    authz_info=dict(roles=roles, permissions=permissions))
@@ -0,0 +1,522 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import time
+from sqlalchemy import delete, select, update
+
+from yosai_alchemystore import (
+    init_async_replica_sessions,
+    init_async_session,
+)
+
+from yosai_alchemystore.models.models import (
+    CredentialType,
+    FailedAttempt,
+    User,
+)
+
+from yosai_alchemystore.accountstore.accountstore import (
+    AlchemyAccountStore,
+    _called_identifier,
+    _check_required_row,
+    _chunked,
+    _scoped_sessions,
+    _unique,
+    _with,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def async_session_context(fn):
+    """
+    Handles AsyncSession setup and teardown.  Within a session_scope, the
+    scope's session is used and is left open for the calls that follow.
+    """
+    @functools.wraps(fn)
+    async def wrap(*args, **kwargs):
+        store = args[0]  # obtain from self
+        session, owned = store._obtain_session(fn.__name__,
+                                               _called_identifier(args, kwargs))
+        try:
+            if store.instrumentation is None:
+                return await fn(*args, session=session, **kwargs)
+
+            measurement, token = store.instrumentation.start(fn.__name__,
+                                                             session.bind.sync_engine)
+            result = None
+            try:
+                started = time.perf_counter()
+                await session.connection()
+                store.instrumentation.checked_out(measurement, started)
+                result = await fn(*args, session=session, **kwargs)
+                return result
+            finally:
+                store.instrumentation.finish(measurement, token, result)
+        finally:
+            if owned:
+                await session.close()
+    return wrap
+
+
+class AsyncAlchemyAccountStore(AlchemyAccountStore):
+    """
+    AsyncAlchemyAccountStore is the asyncio counterpart of AlchemyAccountStore,
+    executing the same queries through an AsyncSession so that lookups don't
+    block the event loop.  Every public method is a coroutine.
+
+    Requires SQLAlchemy 1.4 or later and a Database URL that names an asyncio
+    driver, such as postgresql+asyncpg.
+    """
+
+    def __init__(self, db_url=None, session=None, settings=None,
+                 permission_strategy='auto', effective_permissions=False,
+                 instrumentation=None, permission_format='json', interner=None,
+                 replica_urls=None, replica_sessions=None, replica_policy='round_robin',
+                 read_your_writes=None, track_versions=False, failed_attempts=None,
+                 role_hierarchy=False):
+        """
+        :param session: an AsyncSession factory, as obtained from
+                        init_async_session
+
+        :param replica_sessions: AsyncSession factories of the read replicas,
+                                 as obtained from init_async_replica_sessions
+        """
+        # baked queries are bound to the synchronous Session
+        super().__init__(db_url=db_url,
+                         session=session,
+                         settings=settings,
+                         permission_strategy=permission_strategy,
+                         bake_queries=False,
+                         effective_permissions=effective_permissions,
+                         instrumentation=instrumentation,
+                         permission_format=permission_format,
+                         interner=interner,
+                         replica_urls=replica_urls,
+                         replica_sessions=replica_sessions,
+                         replica_policy=replica_policy,
+                         read_your_writes=read_your_writes,
+                         track_versions=track_versions,
+                         failed_attempts=failed_attempts,
+                         role_hierarchy=role_hierarchy)
+        self._flush_task = None
+        self._flush_stopped = None
+
+    def _init_session(self):
+        return init_async_session(db_url=self._db_url, settings=self._settings)
+
+    def _init_replica_sessions(self, replica_urls):
+        return init_async_replica_sessions(replica_urls, settings=self._settings)
+
+    @contextlib.asynccontextmanager
+    async def session_scope(self, replica=False):
+        """
+        Shares a single AsyncSession among all of the store calls awaited
+        within the scope:
+
+            async with account_store.session_scope():
+                await account_store.get_authc_info(identifier)
+                await account_store.get_authz_roles(identifier)
+
+        An AsyncSession doesn't support concurrent use, so the calls within a
+        scope must be awaited one after another rather than gathered.  The
+        session is rolled back if the scope raises and is always closed.  A
+        replica scope shares a read replica's session, as with
+        AlchemyAccountStore.session_scope.
+        """
+        key, Session = self._scope(replica)
+        sessions = _scoped_sessions.get()
+        if key in sessions:
+            yield sessions[key]
+            return
+
+        session = Session()
+        token = _scoped_sessions.set(_with(sessions, key, session))
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            _scoped_sessions.reset(token)
+            await session.close()
+
+    async def _execute(self, session, builder, identifier, shape=(), **params):
+        """
+        Builds the query of a _get_*_query builder and executes its statement,
+        binding any other parameters of the builder's bindparams
+        """
+        query = builder(session.sync_session, identifier, *shape)
+        return await session.execute(query.statement, params)
+
+    @async_session_context
+    async def get_authc_info(self, identifier, session=None):
+        result = await self._execute(session, self._get_authc_query, identifier)
+        authc_info = self._build_authc_info(result.all())
+        if authc_info is None or self.failed_attempts is None:
+            return authc_info
+
+        result = await self._execute(session, self._get_failed_attempts_query, identifier,
+                                     since=self._failed_attempts_since())
+        return self._add_failed_attempts(authc_info, identifier, result.all())
+
+    @async_session_context
+    async def get_authz_permissions(self, identifier, session=None):
+        try:
+            if self._aggregates_permissions(session):
+                result = await self._execute(session, self._get_permissions_query, identifier)
+                return self._permissions_from_aggregate(result.all())
+            result = await self._execute(session, self._get_permission_rows_query, identifier)
+            return self._permissions_from_rows(result.all())
+        except AttributeError:
+            return None
+
+    @async_session_context
+    async def get_authz_roles(self, identifier, session=None):
+        try:
+            result = await self._execute(session, self._get_roles_query, identifier)
+            return [r.title for r in result.scalars()]
+        except AttributeError:
+            return None
+
+    @async_session_context
+    async def get_authc_info_multi(self, identifier_s, session=None):
+        identifier_s = _unique(identifier_s)
+        rows = collections.defaultdict(list)
+        for chunk in _chunked(identifier_s, self.multi_chunk_size):
+            result = await self._execute(session, self._get_authc_multi_query, chunk)
+            for identifier, *row in result:
+                rows[identifier].append(row)
+
+        result = {identifier: self._build_authc_info(rows.get(identifier))
+                  for identifier in identifier_s}
+        if self.failed_attempts is None:
+            return result
+
+        found = [identifier for identifier in identifier_s if result[identifier] is not None]
+        attempts = collections.defaultdict(list)
+        for chunk in _chunked(found, self.multi_chunk_size):
+            query = await self._execute(session, self._get_failed_attempts_multi_query, chunk,
+                                        since=self._failed_attempts_since())
+            for identifier, *row in query:
+                attempts[identifier].append(row)
+
+        for identifier in found:
+            self._add_failed_attempts(result[identifier], identifier, attempts[identifier])
+        return result
+
+    @async_session_context
+    async def get_authz_permissions_multi(self, identifier_s, session=None):
+        identifier_s = _unique(identifier_s)
+        result = {identifier: {} for identifier in identifier_s}
+        try:
+            aggregates = self._aggregates_permissions(session)
+            builder = (self._get_permissions_multi_query if aggregates else
+                       self._get_permission_rows_multi_query)
+            rows = collections.defaultdict(list)
+            for chunk in _chunked(identifier_s, self.multi_chunk_size):
+                for identifier, *row in await self._execute(session, builder, chunk):
+                    rows[identifier].append(row)
+        except AttributeError:
+            return None
+
+        build = (self._permissions_from_aggregate if aggregates else
+                 self._permissions_from_rows)
+        result.update((identifier, build(perms))
+                      for identifier, perms in rows.items())
+        return result
+
+    @async_session_context
+    async def get_authz_roles_multi(self, identifier_s, session=None):
+        identifier_s = _unique(identifier_s)
+        result = {identifier: [] for identifier in identifier_s}
+        try:
+            for chunk in _chunked(identifier_s, self.multi_chunk_size):
+                query = await self._execute(session, self._get_roles_multi_query, chunk)
+                for identifier, title in query:
+                    result[identifier].append(title)
+        except AttributeError:
+            return None
+        return result
+
+    @async_session_context
+    async def get_account(self, identifier, session=None):
+        result = await self._execute(session, self._get_account_query, identifier)
+        account = self._build_account(session, identifier, result.all())
+        if account is None or self.failed_attempts is None:
+            return account
+
+        result = await self._execute(session, self._get_failed_attempts_query, identifier,
+                                     since=self._failed_attempts_since())
+        return self._add_failed_attempts(account, identifier, result.all())
+
+    async def record_failed_attempt(self, identifier, credential_type='password',
+                                    attempt_millis=None):
+        """
+        Records a failed authentication attempt in the failed_attempts buffer.
+        Rather than through a background thread, the buffer is flushed by a
+        task of the running event loop every flush_interval seconds, by the
+        record_failed_attempt call that finds it full, and by close, which is
+        to be awaited before the event loop ends.
+        """
+        if self.failed_attempts is None:
+            msg = 'record_failed_attempt requires a store created with failed_attempts'
+            raise ValueError(msg)
+
+        if attempt_millis is None:
+            attempt_millis = int(time.time() * 1000)
+
+        if self._flush_task is None:
+            self._flush_stopped = asyncio.Event()
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_when_due())
+
+        if self.failed_attempts.record(identifier, credential_type, attempt_millis):
+            await self.flush_failed_attempts()
+
+    async def _flush_when_due(self):
+        """
+        Flushes the failed_attempts buffer whenever it is due, checking every
+        flush_interval seconds until close, as FlushThread does for
+        AlchemyAccountStore
+        """
+        # rather than the session_scope of the call that created the task
+        _scoped_sessions.set({})
+        while not self._flush_stopped.is_set():
+            try:
+                await asyncio.wait_for(self._flush_stopped.wait(),
+                                       self.failed_attempts.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self.failed_attempts.due:
+                try:
+                    await self.flush_failed_attempts()
+                except Exception:
+                    logger.exception('Failed to flush failed authentication attempts')
+
+    @async_session_context
+    async def flush_failed_attempts(self, session=None):
+        records = self.failed_attempts.drain()
+        if not records:
+            return 0
+
+        try:
+            user_ids = {}
+            identifier_s = _unique(identifier for identifier, _, _ in records)
+            for chunk in _chunked(identifier_s, self.multi_chunk_size):
+                result = await session.execute(select([User.identifier, User.pk_id]).
+                                               where(User.identifier.in_(chunk)))
+                user_ids.update(result.all())
+            result = await session.execute(
+                select([CredentialType.title, CredentialType.pk_id]).
+                where(CredentialType.title.in_({record[1] for record in records})))
+            credential_type_ids = dict(result.all())
+
+            rows = self._failed_attempt_rows(records, user_ids, credential_type_ids)
+            if rows:
+                await session.execute(FailedAttempt.__table__.insert(), rows)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            self.failed_attempts.requeue(records)
+            raise
+        return len(rows)
+
+    @async_session_context
+    async def prune_failed_attempts(self, before_millis=None, session=None):
+        if before_millis is None:
+            before_millis = self._failed_attempts_since()
+        await session.execute(delete(FailedAttempt).
+                              where(FailedAttempt.attempt_millis < before_millis))
+        await session.commit()
+
+    async def close(self):
+        """
+        Stops the flushing task, after which the pending failed attempts are
+        flushed
+        """
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            self._flush_stopped.set()
+            await task
+        if self.failed_attempts is not None:
+            await self.flush_failed_attempts()
+
+    @async_session_context
+    async def is_permitted(self, identifier, domain, action='*', resource='*', session=None):
+        result = await self._execute(session, self._get_permitted_query, identifier,
+                                     domain=domain, action=action, resource=resource)
+        return bool(result.scalar())
+
+    @async_session_context
+    async def is_permitted_multi(self, identifier, permission_s, session=None):
+        result = []
+        for chunk, params in self._permitted_chunks(permission_s):
+            row = (await self._execute(session, self._get_permitted_multi_query, identifier,
+                                       shape=(len(chunk),), **params)).one()
+            result.extend(bool(permitted) for permitted in row)
+        return result
+
+    @async_session_context
+    async def get_permitted_roles(self, domain, action='*', resource='*', session=None):
+        query = self._get_permitted_roles_query(session.sync_session, domain, action, resource)
+        result = await session.execute(query.statement)
+        return [title for title, in result]
+
+    async def iter_permitted_users(self, domain, action='*', resource='*', page_size=1000):
+        """
+        An asynchronous generator of the identifiers of the users that are
+        permitted a permission, read in keyset pages as with
+        AlchemyAccountStore.iter_permitted_users
+        """
+        after = None
+        while True:
+            session, owned = self._obtain_session('iter_permitted_users')
+            try:
+                query = self._get_permitted_users_query(session.sync_session, domain, action,
+                                                        resource, after, page_size)
+                rows = (await session.execute(query.statement)).all()
+            finally:
+                if owned:
+                    await session.close()
+
+            for _, identifier in rows:
+                yield identifier
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    async def iter_authz_info(self, yield_per=1000):
+        """
+        An asynchronous generator of the authorization info of every user,
+        streamed as with AlchemyAccountStore.iter_authz_info
+        """
+        session, owned = self._obtain_session('iter_authz_info')
+        try:
+            statement = self._get_authz_export_query(session.sync_session).statement
+            result = await session.stream(statement.execution_options(yield_per=yield_per))
+
+            rows = []
+            async for row in result:
+                rows.append(row)
+                # a user's rows are grouped once the next user's rows begin
+                if len(rows) > yield_per and rows[-1][0] != rows[-2][0]:
+                    last = rows.pop()
+                    for authz_info in self._build_authz_export(rows):
+                        yield authz_info
+                    rows = [last]
+
+            for authz_info in self._build_authz_export(rows):
+                yield authz_info
+        finally:
+            if owned:
+                await session.close()
+
+    @async_session_context
+    async def is_account_locked(self, identifier, session=None):
+        result = await self._execute(session, self._get_lock_query, identifier)
+        row = result.first()
+        return None if row is None else row[0] is not None
+
+    @async_session_context
+    async def lock_accounts(self, identifier_s, locked_time, session=None):
+        identifier_s = _unique(identifier_s)  # may be a generator
+        await self._execute_statements(session, self._lock_statements(identifier_s, locked_time))
+        self._wrote_lock_state(identifier_s)
+
+    @async_session_context
+    async def unlock_accounts(self, identifier_s, session=None):
+        identifier_s = _unique(identifier_s)  # may be a generator
+        await self._execute_statements(session, self._lock_statements(identifier_s, None))
+        self._wrote_lock_state(identifier_s)
+
+    @async_session_context
+    async def lock_account(self, identifier, locked_time, session=None):
+        await session.execute(update(User).
+                              where(User.identifier == identifier).
+                              values(account_lock_millis=locked_time))
+        await session.commit()
+        self._wrote_lock_state([identifier])
+
+    @async_session_context
+    async def unlock_account(self, identifier, session=None):
+        await session.execute(update(User).
+                              where(User.identifier == identifier).
+                              values(account_lock_millis=None))
+        await session.commit()
+        self._wrote_lock_state([identifier])
+
+    @async_session_context
+    async def get_authz_versions_since(self, version, session=None):
+        query = self._get_authz_version_query(session.sync_session)
+        current = await session.scalar(query.statement)
+        result = await session.execute(
+            self._get_authz_versions_since_query(session.sync_session, version).statement)
+        changes = dict(result.all())
+        return max([current or 0] + list(changes.values())), changes
+
+    async def _execute_statements(self, session, statements):
+        for statement in statements:
+            _check_required_row(statement, await session.execute(statement))
+        await session.commit()
+
+    @async_session_context
+    async def add_role_member(self, identifier, role_title, session=None):
+        await self._execute_statements(
+            session, self._add_role_member_statements(identifier, role_title))
+
+    @async_session_context
+    async def remove_role_member(self, identifier, role_title, session=None):
+        await self._execute_statements(
+            session, self._remove_role_member_statements(identifier, role_title))
+
+    @async_session_context
+    async def grant_role_permission(self, role_title, permission_id, session=None):
+        await self._execute_statements(
+            session, self._grant_role_permission_statements(role_title, permission_id))
+
+    @async_session_context
+    async def revoke_role_permission(self, role_title, permission_id, session=None):
+        await self._execute_statements(
+            session, self._revoke_role_permission_statements(role_title, permission_id))
+
+    @async_session_context
+    async def refresh_effective_permissions(self, identifier=None, session=None):
+        await self._execute_statements(
+            session, self._refresh_effective_permissions_statements(identifier))
+
+    @async_session_context
+    async def add_role_parent(self, role_title, parent_title, session=None):
+        statements = await session.run_sync(self._change_role_parent,
+                                            role_title, parent_title, True)
+        await self._execute_statements(session, statements)
+
+    @async_session_context
+    async def remove_role_parent(self, role_title, parent_title, session=None):
+        statements = await session.run_sync(self._change_role_parent,
+                                            role_title, parent_title, False)
+        await self._execute_statements(session, statements)
+
+    @async_session_context
+    async def refresh_role_closure(self, session=None):
+        await session.run_sync(self._rebuild_role_closure)
+        await session.commit()
@@ -0,0 +1,281 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import collections
+import threading
+import time
+
+from yosai.core import (
+    account_abcs,
+)
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe, least-recently-used cache whose entries expire
+    ttl seconds after they are set
+    """
+
+    def __init__(self, maxsize=10000, ttl=300, timer=time.monotonic):
+        """
+        :type maxsize: int
+        :param ttl: seconds until an entry expires, or None for no expiry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = collections.OrderedDict()  # key: (expires, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :returns: a (found, value) tuple
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+
+            if expires is not None and expires <= self.timer():
+                del self._entries[key]
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value):
+        expires = self.timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    size=len(self._entries))
+
+
+class CachingAccountStore(account_abcs.CredentialsAccountStore,
+                          account_abcs.AuthorizationAccountStore,
+                          account_abcs.LockingAccountStore):
+    """
+    CachingAccountStore decorates an AlchemyAccountStore with an in-process
+    LRUCache of authorization info, for single-node deployments that don't
+    use an external yosai cache.
+
+    Authentication info is never cached, so lock state is always current.
+    Cached entries of an identifier are invalidated when its account is
+    locked or unlocked or its role memberships change, and all entries are
+    invalidated when a role's permissions or parents change.  A value read
+    while its identifier is invalidated, such as by another thread, isn't
+    cached.  Any other attribute is delegated to the decorated account store.
+    """
+
+    def __init__(self, account_store, maxsize=10000, ttl=300):
+        """
+        :param account_store: the AlchemyAccountStore to decorate
+        :param maxsize: the maximum number of cached entries
+        :param ttl: seconds until a cached entry expires
+        """
+        self.account_store = account_store
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.version = None
+        # bumped by invalidate, so that a value read while its identifier is
+        # invalidated isn't cached:  the generation of every identifier, and
+        # that of each identifier invalidated since, up to maxsize of them
+        self._generation = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.account_store, name)
+
+    @property
+    def stats(self):
+        """
+        :returns: a dict of hit, miss and eviction counters
+        """
+        return self.cache.stats
+
+    def invalidate(self, identifier=None):
+        """
+        Removes the cached entries of an identifier, or of every identifier
+        when none is given
+        """
+        with self._lock:
+            if identifier is None or len(self._generations) >= self.cache.maxsize:
+                self._generation += 1
+                self._generations.clear()
+            if identifier is not None:
+                self._generations[identifier] = self._generations.get(identifier, 0) + 1
+
+        if identifier is None:
+            self.cache.clear()
+        else:
+            self.cache.delete(('permissions', identifier))
+            self.cache.delete(('roles', identifier))
+
+    def _generation_of(self, identifier):
+        # called with the lock held
+        return self._generation, self._generations.get(identifier, 0)
+
+    def _set(self, kind, identifier, value, generation):
+        """
+        Caches a value read from the decorated store, unless its identifier
+        has been invalidated since the read began, at generation
+        """
+        with self._lock:
+            if self._generation_of(identifier) == generation:
+                self.cache.set((kind, identifier), value)
+
+    def invalidate_changed(self):
+        """
+        Invalidates the cached entries of the identifiers whose roles or
+        permissions have changed since the previous call, including changes
+        made through other processes, when the decorated store was created
+        with track_versions=True.  The first call establishes the version
+        from which the following calls poll.
+
+        :returns: the identifiers invalidated
+        """
+        version, changes = self.account_store.get_authz_versions_since(self.version or 0)
+        if self.version is None:
+            changes = {}
+        for identifier in changes:
+            self.invalidate(identifier)
+        self.version = version
+        return list(changes)
+
+    def _get_or_create(self, kind, identifier, creator):
+        found, value = self.cache.get((kind, identifier))
+        if not found:
+            with self._lock:
+                generation = self._generation_of(identifier)
+            value = creator(identifier)
+            if value is not None:
+                self._set(kind, identifier, value, generation)
+        return value
+
+    def _get_or_create_multi(self, kind, identifier_s, creator):
+        result = {}
+        missing = []
+        for identifier in identifier_s:
+            found, value = self.cache.get((kind, identifier))
+            if found:
+                result[identifier] = value
+            else:
+                missing.append(identifier)
+
+        if missing:
+            with self._lock:
+                generations = {identifier: self._generation_of(identifier)
+                               for identifier in missing}
+            created = creator(missing)
+            if created is None:
+                return None
+            for identifier, value in created.items():
+                self._set(kind, identifier, value, generations[identifier])
+            result.update(created)
+
+        return result
+
+    def get_authc_info(self, identifier):
+        return self.account_store.get_authc_info(identifier)
+
+    def get_authz_permissions(self, identifier):
+        return self._get_or_create('permissions', identifier,
+                                   self.account_store.get_authz_permissions)
+
+    def get_authz_roles(self, identifier):
+        return self._get_or_create('roles', identifier,
+                                   self.account_store.get_authz_roles)
+
+    def get_authz_permissions_multi(self, identifier_s):
+        return self._get_or_create_multi('permissions', identifier_s,
+                                         self.account_store.get_authz_permissions_multi)
+
+    def get_authz_roles_multi(self, identifier_s):
+        return self._get_or_create_multi('roles', identifier_s,
+                                         self.account_store.get_authz_roles_multi)
+
+    def lock_account(self, identifier, locked_time):
+        self.account_store.lock_account(identifier, locked_time)
+        self.invalidate(identifier)
+
+    def unlock_account(self, identifier):
+        self.account_store.unlock_account(identifier)
+        self.invalidate(identifier)
+
+    def lock_accounts(self, identifier_s, locked_time):
+        identifier_s = list(identifier_s)  # may be a generator
+        self.account_store.lock_accounts(identifier_s, locked_time)
+        for identifier in identifier_s:
+            self.invalidate(identifier)
+
+    def unlock_accounts(self, identifier_s):
+        identifier_s = list(identifier_s)  # may be a generator
+        self.account_store.unlock_accounts(identifier_s)
+        for identifier in identifier_s:
+            self.invalidate(identifier)
+
+    def add_role_member(self, identifier, role_title):
+        self.account_store.add_role_member(identifier, role_title)
+        self.invalidate(identifier)
+
+    def remove_role_member(self, identifier, role_title):
+        self.account_store.remove_role_member(identifier, role_title)
+        self.invalidate(identifier)
+
+    def grant_role_permission(self, role_title, permission_id):
+        self.account_store.grant_role_permission(role_title, permission_id)
+        self.invalidate()
+
+    def revoke_role_permission(self, role_title, permission_id):
+        self.account_store.revoke_role_permission(role_title, permission_id)
+        self.invalidate()
+
+    def add_role_parent(self, role_title, parent_title):
+        self.account_store.add_role_parent(role_title, parent_title)
+        self.invalidate()
+
+    def remove_role_parent(self, role_title, parent_title):
+        self.account_store.remove_role_parent(role_title, parent_title)
+        self.invalidate()
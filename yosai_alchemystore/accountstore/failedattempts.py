@@ -0,0 +1,149 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FailedAttemptBuffer:
+    """
+    FailedAttemptBuffer is the write-behind buffer of the failed
+    authentication attempts recorded through an AlchemyAccountStore.  Attempts
+    are coalesced per (identifier, credential type), keeping only the most
+    recent per_key_limit of each, and are written to the failed_attempt table
+    in batches:  once max_size attempts are pending, or once the oldest has
+    been pending for flush_interval seconds.
+    """
+
+    def __init__(self, max_size=1000, flush_interval=1.0, per_key_limit=100,
+                 timer=time.monotonic):
+        """
+        :param max_size: the number of pending attempts that triggers a flush
+        :param flush_interval: the seconds after which a pending attempt is
+                               flushed
+        :param per_key_limit: the number of attempts kept per identifier and
+                              credential type between flushes
+        """
+        if max_size < 1 or flush_interval <= 0 or per_key_limit < 1:
+            msg = ('FailedAttemptBuffer requires a positive max_size, flush_interval '
+                   'and per_key_limit')
+            raise ValueError(msg)
+
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.per_key_limit = per_key_limit
+        self.timer = timer
+        # identifier: {credential_type: [attempt_millis]}
+        self._pending = collections.defaultdict(dict)
+        self._size = 0
+        self._since = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def due(self):
+        """
+        :returns: True when the pending attempts are to be flushed
+        """
+        return (self._size >= self.max_size or
+                (self._since is not None and
+                 self.timer() - self._since >= self.flush_interval))
+
+    def record(self, identifier, credential_type, attempt_millis):
+        """
+        :returns: True when the pending attempts are to be flushed
+        """
+        with self._lock:
+            self._add(identifier, credential_type, [attempt_millis])
+        return self.due
+
+    def _add(self, identifier, credential_type, attempt_millis_s):
+        # called with the lock held
+        attempts = self._pending[identifier].setdefault(credential_type, [])
+        self._size -= len(attempts)
+        attempts.extend(attempt_millis_s)
+        attempts.sort()
+        del attempts[:-self.per_key_limit]
+        self._size += len(attempts)
+        if self._since is None:
+            self._since = self.timer()
+
+    def drain(self):
+        """
+        Removes the pending attempts
+
+        :returns: a list of (identifier, credential_type, attempt_millis)
+        """
+        with self._lock:
+            pending, self._pending = self._pending, collections.defaultdict(dict)
+            self._size, self._since = 0, None
+        return [(identifier, credential_type, attempt_millis)
+                for identifier, attempts_by_type in pending.items()
+                for credential_type, attempts in attempts_by_type.items()
+                for attempt_millis in attempts]
+
+    def requeue(self, records):
+        """
+        Returns drained attempts that could not be written to the buffer
+        """
+        with self._lock:
+            for identifier, credential_type, attempt_millis in records:
+                self._add(identifier, credential_type, [attempt_millis])
+
+    def pending(self, identifier):
+        """
+        :returns: a dict of credential type to the pending attempts of an
+                  identifier, which are yet to be read from the database
+        """
+        with self._lock:
+            return {credential_type: list(attempts)
+                    for credential_type, attempts in self._pending.get(identifier, {}).items()}
+
+
+class FlushThread(threading.Thread):
+    """
+    A daemon thread that calls flush whenever its FailedAttemptBuffer is due,
+    checking every flush_interval seconds or when woken
+    """
+
+    def __init__(self, buffer, flush):
+        super().__init__(name='yosai_alchemystore-failed-attempts', daemon=True)
+        self.buffer = buffer
+        self.flush = flush
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.buffer.flush_interval)
+            self.wake.clear()
+            if self.buffer.due:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Failed to flush failed authentication attempts')
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
@@ -0,0 +1,242 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# the bucket upper bounds of duration (milliseconds) and count histograms
+DURATION_BOUNDS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+COUNT_BOUNDS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000)
+
+METRIC_BOUNDS = {'duration_ms': DURATION_BOUNDS,
+                 'checkout_ms': DURATION_BOUNDS,
+                 'execute_ms': DURATION_BOUNDS,
+                 'round_trips': COUNT_BOUNDS,
+                 'items': COUNT_BOUNDS}
+
+_current = contextvars.ContextVar('yosai_alchemystore_measurement', default=None)
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram, whose percentiles are estimated as the upper
+    bound of the bucket that they fall in
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket is unbounded
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def dump(self):
+        return dict(count=self.count,
+                    sum=self.total,
+                    min=self.min,
+                    max=self.max,
+                    mean=self.total / self.count if self.count else None,
+                    p50=self.percentile(50),
+                    p90=self.percentile(90),
+                    p99=self.percentile(99),
+                    buckets=dict(zip([str(b) for b in self.bounds] + ['inf'], self.counts)))
+
+
+class Measurement:
+    """
+    The metrics of a single account store call
+    """
+    __slots__ = ('method', 'duration_ms', 'checkout_ms', 'execute_ms',
+                 'round_trips', 'items', '_started', '_executing')
+
+    def __init__(self, method):
+        self.method = method
+        self.duration_ms = 0.0
+        self.checkout_ms = 0.0
+        self.execute_ms = 0.0
+        self.round_trips = 0
+        self.items = 0
+        self._started = time.perf_counter()
+        self._executing = None
+
+    def metrics(self):
+        return dict(duration_ms=self.duration_ms,
+                    checkout_ms=self.checkout_ms,
+                    execute_ms=self.execute_ms,
+                    round_trips=self.round_trips,
+                    items=self.items)
+
+
+def _count_items(result):
+    """
+    The number of items that a store method returned, such as the entries of
+    a dict or list, which is not the number of database rows fetched
+    """
+    if result is None:
+        return 0
+    try:
+        return len(result)
+    except TypeError:
+        return 1
+
+
+class Instrumentation:
+    """
+    Instrumentation records, for each account store call, its duration,
+    connection checkout wait, time spent executing SQL, number of round trips
+    and number of items returned.  Each call's metrics are aggregated into
+    in-process histograms, per method, and are passed to every sink.
+
+    A sink is a callable of (method, metrics) such as logging_sink or
+    statsd_sink.
+
+    The time not spent in checkout or execution is that of query construction
+    and result processing (ORM hydration).
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._engines = set()
+
+    def instrument(self, engine):
+        """
+        Listens to the statement executions of an engine, once per engine
+        """
+        with self._lock:
+            if engine in self._engines:
+                return
+            self._engines.add(engine)
+
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def start(self, method, engine=None):
+        """
+        :returns: a (measurement, token) tuple to pass to finish
+        """
+        if engine is not None:
+            self.instrument(engine)
+        measurement = Measurement(method)
+        return measurement, _current.set(measurement)
+
+    def checked_out(self, measurement, started):
+        measurement.checkout_ms = (time.perf_counter() - started) * 1000
+
+    def finish(self, measurement, token, result=None):
+        _current.reset(token)
+        measurement.duration_ms = (time.perf_counter() - measurement._started) * 1000
+        measurement.items = _count_items(result)
+        self.record(measurement.method, measurement.metrics())
+
+    def record(self, method, metrics):
+        with self._lock:
+            for name, value in metrics.items():
+                key = (method, name)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(METRIC_BOUNDS[name])
+                histogram.add(value)
+
+        for sink in self.sinks:
+            try:
+                sink(method, metrics)
+            except Exception:
+                logger.exception('Instrumentation sink {0} failed'.format(sink))
+
+    def dump(self):
+        """
+        :returns: a dict of method to a dict of metric to histogram summary
+        """
+        with self._lock:
+            result = {}
+            for (method, name), histogram in sorted(self.histograms.items()):
+                result.setdefault(method, {})[name] = histogram.dump()
+            return result
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.round_trips += 1
+        measurement._executing = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    measurement = _current.get()
+    if measurement is not None and measurement._executing is not None:
+        measurement.execute_ms += (time.perf_counter() - measurement._executing) * 1000
+        measurement._executing = None
+
+
+def logging_sink(logger=logger, level=logging.DEBUG):
+    """
+    :returns: a sink that logs each call's metrics
+    """
+    def sink(method, metrics):
+        logger.log(level, '{0} {1}'.format(
+            method, ' '.join('{0}={1:.3f}'.format(k, v) if isinstance(v, float)
+                             else '{0}={1}'.format(k, v)
+                             for k, v in sorted(metrics.items()))))
+    return sink
+
+
+def statsd_sink(client, prefix='yosai_alchemystore'):
+    """
+    :param client: a statsd client, providing timing(stat, ms) and
+                   incr(stat, count)
+    :returns: a sink that emits durations as timers and counts as counters
+    """
+    def sink(method, metrics):
+        for name, value in metrics.items():
+            stat = '{0}.{1}.{2}'.format(prefix, method, name)
+            if name.endswith('_ms'):
+                client.timing(stat, value)
+            else:
+                client.incr(stat, value)
+    return sink
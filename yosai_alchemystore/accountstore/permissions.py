@@ -0,0 +1,91 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import collections
+import json
+import sys
+import threading
+
+
+class PermissionParts(collections.namedtuple('PermissionParts',
+                                             'domain action resource')):
+    """
+    The compact, pre-parsed form of a permission's parts:  a domain name and
+    frozensets of action and resource names, '*' being the wildcard
+    """
+    __slots__ = ()
+
+    def as_parts(self):
+        """
+        :returns: the parts dict accepted by yosai's DefaultPermission
+        """
+        return {'domain': self.domain,
+                'action': set(self.action),
+                'target': set(self.resource)}
+
+
+class PermissionInterner:
+    """
+    PermissionInterner shares a single instance of each distinct name,
+    frozenset of names and PermissionParts among all of the permissions that
+    it creates, so that a large population of users holding the same grants
+    costs the memory of one copy
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._parts)
+
+    def _names_of(self, names):
+        return frozenset(sys.intern(name) for name in names)
+
+    def parts(self, domain, actions, resources):
+        """
+        :returns: the shared PermissionParts of a domain name and iterables of
+                  action and resource names
+        """
+        key = (domain, frozenset(actions), frozenset(resources))
+        parts = self._parts.get(key)
+        if parts is None:
+            with self._lock:
+                parts = self._parts.get(key)
+                if parts is None:
+                    parts = PermissionParts(sys.intern(domain),
+                                            self._intern_set(key[1]),
+                                            self._intern_set(key[2]))
+                    self._parts[key] = parts
+        return parts
+
+    def _intern_set(self, names):
+        # called with the lock held
+        shared = self._names.get(names)
+        if shared is None:
+            shared = self._names[names] = self._names_of(names)
+        return shared
+
+    def from_json(self, text):
+        """
+        :param text: a json list of parts, as aggregated by the database
+        :returns: a tuple of shared PermissionParts
+        """
+        return tuple(self.parts(parts['domain'], parts['action'], parts['resource'])
+                     for parts in json.loads(text))
@@ -0,0 +1,120 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import collections
+import itertools
+import threading
+import time
+
+from sqlalchemy import event
+
+
+class ReplicaRouter:
+    """
+    ReplicaRouter chooses the read replica that serves each read of an
+    AlchemyAccountStore, among the session factories of its replicas:
+        'round_robin' -- each replica in turn
+        'least_loaded' -- the replica with the fewest connections checked
+                          out of its pool, as counted by pool events
+    """
+
+    def __init__(self, sessions, policy='round_robin'):
+        """
+        :param sessions: the Session (or AsyncSession) factories of the
+                         replicas, as obtained from init_session
+        :type sessions: list
+
+        :type policy: string
+        """
+        if not sessions:
+            raise ValueError('ReplicaRouter requires at least one replica session')
+        if policy not in ('round_robin', 'least_loaded'):
+            msg = ("policy must be one of 'round_robin' or 'least_loaded', "
+                   "not {0}".format(policy))
+            raise ValueError(msg)
+
+        self.sessions = list(sessions)
+        self.policy = policy
+        self._turns = itertools.count()
+        self._checked_out = [0] * len(self.sessions)
+
+        if policy == 'least_loaded':
+            for index, session in enumerate(self.sessions):
+                self._count_checkouts(index, session)
+
+    def _count_checkouts(self, index, session):
+        try:
+            engine = session.kw['bind']
+        except (AttributeError, KeyError):
+            msg = "'least_loaded' requires replica sessions that are bound to an engine"
+            raise ValueError(msg)
+        engine = getattr(engine, 'sync_engine', engine)  # an AsyncEngine
+
+        counts = self._checked_out
+
+        @event.listens_for(engine, 'checkout')
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            counts[index] += 1
+
+        @event.listens_for(engine, 'checkin')
+        def checkin(dbapi_connection, connection_record):
+            counts[index] -= 1
+
+    def choose(self):
+        """
+        :returns: the session factory of the replica to read from
+        """
+        if self.policy == 'least_loaded':
+            counts = self._checked_out
+            return self.sessions[min(range(len(counts)), key=counts.__getitem__)]
+        return self.sessions[next(self._turns) % len(self.sessions)]
+
+
+class RecentWrites:
+    """
+    RecentWrites remembers the identifiers written through a store for a
+    number of seconds, so that their reads can be pinned to the primary until
+    the replicas have caught up with the write
+    """
+
+    def __init__(self, seconds, timer=time.monotonic):
+        self.seconds = seconds
+        self.timer = timer
+        # identifier: expiry, in the order of expiry, as every write is
+        # remembered for the same number of seconds
+        self._expiries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        expiries = self._expiries
+        while expiries and next(iter(expiries.values())) <= now:
+            expiries.popitem(last=False)
+
+    def add(self, identifier_s):
+        with self._lock:
+            now = self.timer()
+            expiry = now + self.seconds
+            for identifier in identifier_s:
+                self._expiries[identifier] = expiry
+                self._expiries.move_to_end(identifier)
+            self._expire(now)
+
+    def __contains__(self, identifier):
+        with self._lock:
+            expiry = self._expiries.get(identifier)
+        return expiry is not None and expiry > self.timer()
@@ -0,0 +1,254 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+benchmark.py measures the latency (p50/p99) and throughput of each
+AlchemyAccountStore method, for a synthetic dataset, across databases and
+store configurations:
+
+    python -m yosai_alchemystore.benchmark.benchmark --users 100000 \\
+        --db-url sqlite:// --db-url sqlite:///bench.db \\
+        --db-url postgresql://localhost/bench
+
+Each database is dropped, recreated and populated before it is measured.
+With --compare-indexes, each database is measured again without the
+indexes of the user-driven join paths, JOIN_INDEXES.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy.pool import StaticPool
+
+from yosai_alchemystore import (
+    AlchemyAccountStore,
+    Base,
+    init_engine,
+    init_session,
+)
+
+from yosai_alchemystore.benchmark.dataset import (
+    SyntheticDataset,
+)
+
+# the indexes of the user-driven join paths and foreign keys, which
+# --compare-indexes drops for a second run
+JOIN_INDEXES = (
+    'ix_role_membership_user_id',
+    'ix_role_permission_permission_id',
+    'ix_credential_user_id',
+    'ix_credential_credential_type_id',
+    'ix_permission_domain_id',
+    'ix_permission_action_id',
+    'ix_permission_resource_id',
+)
+
+# store configurations, as AlchemyAccountStore keyword arguments
+CONFIGURATIONS = {
+    'default': {},
+    'unbaked': dict(bake_queries=False),
+    'flat': dict(permission_strategy='flat'),
+    'aggregate': dict(permission_strategy='aggregate'),
+    'effective': dict(effective_permissions=True),
+    'core': dict(core_reads=True),
+    'compact': dict(permission_format='compact'),
+}
+
+
+def _legacy_get_authc_info(store, identifier):
+    """
+    The two-query authc lookup that get_authc_info replaced, for comparison
+    """
+    session = store.Session()
+    try:
+        user = store._get_user_query(session, identifier).first()
+        creds = store._get_credential_query(session, identifier).all()
+        return user, creds
+    finally:
+        session.close()
+
+
+# name: callable of (store, identifiers)
+METHODS = {
+    'get_authc_info': lambda store, ids: store.get_authc_info(ids[0]),
+    'get_authc_info (two queries)': lambda store, ids: _legacy_get_authc_info(store, ids[0]),
+    'get_authz_permissions': lambda store, ids: store.get_authz_permissions(ids[0]),
+    'get_authz_roles': lambda store, ids: store.get_authz_roles(ids[0]),
+    'get_account': lambda store, ids: store.get_account(ids[0]),
+    'is_account_locked': lambda store, ids: store.is_account_locked(ids[0]),
+    'is_permitted': lambda store, ids: store.is_permitted(ids[0], 'domain0', 'action0',
+                                                          'resource0'),
+    'get_authc_info_multi': lambda store, ids: store.get_authc_info_multi(ids),
+    'get_authz_permissions_multi': lambda store, ids: store.get_authz_permissions_multi(ids),
+    'get_authz_roles_multi': lambda store, ids: store.get_authz_roles_multi(ids),
+}
+
+
+def percentile(samples, p):
+    """
+    :param samples: a sorted list
+    """
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))]
+
+
+def measure(fn, args_s, warmup=10):
+    """
+    Calls fn with each of args_s, after warmup calls
+
+    :returns: a dict of p50 and p99 latency (ms), mean CPU time of the
+              process (ms) and throughput (calls/s)
+    """
+    for args in args_s[:warmup]:
+        fn(*args)
+
+    timings = []
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for args in args_s:
+        t0 = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - t0)
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return dict(p50=percentile(timings, 50) * 1000,
+                p99=percentile(timings, 99) * 1000,
+                cpu=cpu / len(timings) * 1000 if timings else 0.0,
+                throughput=len(timings) / elapsed if elapsed else 0.0)
+
+
+def create_engine_for(db_url):
+    if db_url in ('sqlite://', 'sqlite:///:memory:'):
+        # a single shared connection, or every session would see its own database
+        return init_engine(db_url, poolclass=StaticPool,
+                           connect_args={'check_same_thread': False})
+    return init_engine(db_url)
+
+
+def drop_indexes(engine, names):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.drop(engine)
+
+
+def run(db_url, dataset, configurations, methods, calls=1000, batch_size=100, seed=0,
+        indexes=True):
+    """
+    :param indexes: whether the JOIN_INDEXES are kept, rather than dropped
+                    once the dataset is populated
+    :returns: a list of (configuration, method, result) tuples
+    """
+    engine = create_engine_for(db_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    t0 = time.perf_counter()
+    dataset.populate(engine)
+    print('{0}: populated in {1:.1f}s'.format(db_url, time.perf_counter() - t0))
+
+    if not indexes:
+        drop_indexes(engine, JOIN_INDEXES)
+
+    rand = random.Random(seed)
+    Session = init_session(engine=engine)
+    results = []
+    for config_name in configurations:
+        config = CONFIGURATIONS[config_name]
+        if (config.get('permission_strategy') == 'aggregate' and
+                engine.dialect.name != 'postgresql'):
+            continue
+
+        store = AlchemyAccountStore(session=Session, **config)
+        if config.get('effective_permissions'):
+            store.refresh_effective_permissions()
+
+        for method_name in methods:
+            size = batch_size if method_name.endswith('_multi') else 1
+            args_s = [(store, [dataset.identifier(rand.randrange(dataset.users))
+                               for _ in range(size)])
+                      for _ in range(calls if size == 1 else max(1, calls // size))]
+            results.append((config_name, method_name,
+                            measure(METHODS[method_name], args_s)))
+
+    engine.dispose()
+    return results
+
+
+def report(db_url, results):
+    print('\n{0}'.format(db_url))
+    print('{0:<12} {1:<30} {2:>10} {3:>10} {4:>10} {5:>12}'.
+          format('config', 'method', 'p50 ms', 'p99 ms', 'cpu ms', 'calls/s'))
+    for config_name, method_name, result in results:
+        print('{0:<12} {1:<30} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>12.1f}'.
+              format(config_name, method_name, result['p50'], result['p99'],
+                     result['cpu'], result['throughput']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db-url', action='append', dest='db_urls',
+                        help='a Database URL to benchmark (repeatable); '
+                             'defaults to an in-memory sqlite database')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--roles', type=int, default=100)
+    parser.add_argument('--roles-per-user', type=int, default=3)
+    parser.add_argument('--permissions', type=int, default=5000)
+    parser.add_argument('--permissions-per-role', type=int, default=50)
+    parser.add_argument('--wildcard-ratio', type=float, default=0.1)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='the number of identifiers per *_multi call')
+    parser.add_argument('--config', action='append', dest='configurations',
+                        choices=sorted(CONFIGURATIONS),
+                        help='a store configuration (repeatable); defaults to all')
+    parser.add_argument('--method', action='append', dest='methods',
+                        choices=sorted(METHODS),
+                        help='a store method (repeatable); defaults to all')
+    parser.add_argument('--compare-indexes', action='store_true',
+                        help='measure each database again without the JOIN_INDEXES')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    dataset = SyntheticDataset(users=args.users,
+                               roles=args.roles,
+                               roles_per_user=args.roles_per_user,
+                               permissions=args.permissions,
+                               permissions_per_role=args.permissions_per_role,
+                               wildcard_ratio=args.wildcard_ratio,
+                               seed=args.seed)
+
+    for db_url in args.db_urls or ['sqlite://']:
+        for indexes in ([True, False] if args.compare_indexes else [True]):
+            results = run(db_url, dataset,
+                          configurations=args.configurations or sorted(CONFIGURATIONS),
+                          methods=args.methods or list(METHODS),
+                          calls=args.calls,
+                          batch_size=args.batch_size,
+                          seed=args.seed,
+                          indexes=indexes)
+            report(db_url if indexes else '{0} (without JOIN_INDEXES)'.format(db_url),
+                   results)
+
+
+if __name__ == '__main__':
+    main()
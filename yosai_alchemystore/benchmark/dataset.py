@@ -0,0 +1,124 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+dataset.py generates a synthetic RBAC population of any size, as rows for
+the BulkImporter.  Generation is deterministic for a given seed.
+"""
+import datetime
+import random
+
+from yosai_alchemystore.provisioning.provisioning import (
+    BulkImporter,
+)
+
+
+class SyntheticDataset:
+
+    def __init__(self, users=1000, roles=50, roles_per_user=3,
+                 permissions=1000, permissions_per_role=20, wildcard_ratio=0.1,
+                 domains=20, actions=10, resources=200, totp_ratio=0.1, seed=0):
+        """
+        :param wildcard_ratio: the probability of each of a permission's
+                               domain, action and resource being null (*)
+        :param totp_ratio: the share of users that also have a totp_key
+        """
+        self.users = users
+        self.roles = roles
+        self.roles_per_user = min(roles_per_user, roles)
+        self.permissions = permissions
+        self.permissions_per_role = min(permissions_per_role, permissions)
+        self.wildcard_ratio = wildcard_ratio
+        self.domains = domains
+        self.actions = actions
+        self.resources = resources
+        self.totp_ratio = totp_ratio
+        self.seed = seed
+
+    def identifier(self, i):
+        return 'user{0}'.format(i)
+
+    def role(self, i):
+        return 'role{0}'.format(i)
+
+    def _random(self, salt):
+        return random.Random('{0}:{1}'.format(self.seed, salt))
+
+    def _permission_parts(self):
+        rand = self._random('permissions')
+        parts = []
+        for _ in range(self.permissions):
+            def part(prefix, count):
+                if rand.random() < self.wildcard_ratio:
+                    return None
+                return '{0}{1}'.format(prefix, rand.randrange(count))
+            parts.append((part('domain', self.domains),
+                          part('action', self.actions),
+                          part('resource', self.resources)))
+        return parts
+
+    def user_rows(self):
+        for i in range(self.users):
+            yield dict(identifier=self.identifier(i),
+                       first_name='first{0}'.format(i),
+                       last_name='last{0}'.format(i),
+                       phone_number='1{0:010d}'.format(i))
+
+    def role_rows(self):
+        for i in range(self.roles):
+            yield dict(title=self.role(i))
+
+    def credential_rows(self):
+        rand = self._random('credentials')
+        expiration_dt = datetime.datetime.now() + datetime.timedelta(days=30)
+        for i in range(self.users):
+            yield dict(identifier=self.identifier(i),
+                       credential_type='password',
+                       credential='$bcrypt-sha256$synthetic{0}'.format(i),
+                       expiration_dt=expiration_dt)
+            if rand.random() < self.totp_ratio:
+                yield dict(identifier=self.identifier(i),
+                           credential_type='totp_key',
+                           credential='TOTPKEY{0}'.format(i),
+                           expiration_dt=expiration_dt)
+
+    def role_membership_rows(self):
+        rand = self._random('memberships')
+        for i in range(self.users):
+            for role in rand.sample(range(self.roles), self.roles_per_user):
+                yield dict(identifier=self.identifier(i), role=self.role(role))
+
+    def role_permission_rows(self):
+        rand = self._random('grants')
+        parts = self._permission_parts()
+        for role in range(self.roles):
+            for domain, action, resource in rand.sample(parts, self.permissions_per_role):
+                yield dict(role=self.role(role),
+                           domain=domain, action=action, resource=resource)
+
+    def populate(self, engine, chunk_size=10000):
+        """
+        Loads the dataset into an engine's (empty) database
+        """
+        importer = BulkImporter(engine, chunk_size=chunk_size)
+        importer.import_users(self.user_rows())
+        importer.import_roles(self.role_rows())
+        importer.import_credentials(self.credential_rows())
+        importer.import_role_permissions(self.role_permission_rows())
+        importer.import_role_memberships(self.role_membership_rows())
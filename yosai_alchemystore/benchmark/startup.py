@@ -0,0 +1,97 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+startup.py measures the cold start of a process that uses the store -- the
+import of the package, the construction of an AlchemyAccountStore and its
+first connection -- each in a fresh interpreter:
+
+    python -m yosai_alchemystore.benchmark.startup --runs 20 \\
+        --db-url sqlite://
+"""
+import argparse
+import subprocess
+import sys
+
+from yosai_alchemystore.benchmark.benchmark import (
+    percentile,
+)
+
+# name: the statements timed in a fresh interpreter, formatted with db_url
+STEPS = {
+    'import package': 'import yosai_alchemystore',
+    'import store': 'from yosai_alchemystore import AlchemyAccountStore',
+    'construct store': ('from yosai_alchemystore import AlchemyAccountStore\n'
+                        'store = AlchemyAccountStore({db_url!r})'),
+    'first connection': ('from yosai_alchemystore import AlchemyAccountStore\n'
+                         'store = AlchemyAccountStore({db_url!r})\n'
+                         'store.Session().connection()'),
+}
+
+TIMER = """
+import time
+t0 = time.perf_counter()
+exec({code!r})
+print(time.perf_counter() - t0)
+"""
+
+
+def measure(code, runs):
+    """
+    Runs code in runs fresh interpreters
+
+    :returns: a dict of p50 and p99 duration (ms) of code in the interpreter
+    """
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', TIMER.format(code=code)])
+        timings.append(float(output.decode().split()[-1]))
+
+    timings.sort()
+    return dict(p50=percentile(timings, 50) * 1000,
+                p99=percentile(timings, 99) * 1000)
+
+
+def report(db_url, results):
+    print('\n{0}'.format(db_url))
+    print('{0:<20} {1:>10} {2:>10}'.format('step', 'p50 ms', 'p99 ms'))
+    for step_name, result in results:
+        print('{0:<20} {1:>10.3f} {2:>10.3f}'.
+              format(step_name, result['p50'], result['p99']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db-url', default='sqlite://',
+                        help='the Database URL of the store; defaults to an '
+                             'in-memory sqlite database')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='the number of interpreters started per step')
+    parser.add_argument('--step', action='append', dest='steps',
+                        choices=list(STEPS),
+                        help='a startup step (repeatable); defaults to all')
+    args = parser.parse_args(argv)
+
+    results = [(step_name, measure(STEPS[step_name].format(db_url=args.db_url), args.runs))
+               for step_name in args.steps or list(STEPS)]
+    report(args.db_url, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,10 @@ under the License.
 """
 class AccountStoreSettings:
 
+    # connection pool options of engine_config that are passed to create_engine
+    pool_keys = ('poolclass', 'pool_size', 'max_overflow', 'pool_timeout',
+                 'pool_pre_ping', 'pool_recycle')
+
     def __init__(self, settings):
         try:
             self.account_store_config = settings.ALCHEMY_STORE
@@ -30,6 +34,12 @@ class AccountStoreSettings:
             self.port = self.engine_config.get('port')
             self.db = self.engine_config.get('db')
             self.echo = self.engine_config.get('echo', False)
+            self.pool_config = {key: self.engine_config[key]
+                                for key in self.pool_keys
+                                if self.engine_config.get(key) is not None}
+
+            # 'Database URL's of read replicas of the database
+            self.replica_urls = list(self.engine_config.get('replicas') or ())
 
         except (AttributeError, TypeError) as exc:
             msg = ('yosai_alchemystore AlchemyStoreSettings requires a LazySettings instance '
@@ -17,7 +17,7 @@ specific language governing permissions and limitations
 under the License.
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, pool
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from yosai_alchemystore import AccountStoreSettings
@@ -25,7 +25,7 @@ from yosai_alchemystore import AccountStoreSettings
 Base = declarative_base()
 
 
-def init_engine(db_url=None, echo=False, settings=None):
+def init_engine(db_url=None, echo=False, settings=None, **pool_config):
     """
 
     You can configure the engine in two ways:
@@ -42,24 +42,109 @@ def init_engine(db_url=None, echo=False, settings=None):
     When a 'Database URL' string isn't passed, the YAML configuration approach
     is attempted by default.
 
+    Connection pooling is configured through the pool_config keyword
+    arguments or the same keys of the YAML engine_config, the keyword
+    arguments taking precedence:
+        poolclass:  the name of a sqlalchemy.pool class, such as QueuePool,
+                    NullPool or StaticPool
+        pool_size, max_overflow, pool_timeout, pool_pre_ping, pool_recycle:
+                    as supported by create_engine
+
     :type db_url: string
     :type echo: bool
     """
+    url, pool_config = _engine_config(db_url, settings, pool_config)
+    engine = create_engine(url, echo=echo, **pool_config)
+    return engine
+
+
+def init_async_engine(db_url=None, echo=False, settings=None, **pool_config):
+    """
+    The asyncio counterpart of init_engine, configured the same way.  The
+    Database URL must name an asyncio driver, such as postgresql+asyncpg.
+
+    Requires SQLAlchemy 1.4 or later.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url, pool_config = _engine_config(db_url, settings, pool_config)
+    engine = create_async_engine(url, echo=echo, **pool_config)
+    return engine
+
+
+def _engine_config(db_url, settings, pool_config):
+    """
+    :returns: a (url, pool_config) tuple of create_engine arguments
+    """
     if db_url is None:
         acct_settings = AccountStoreSettings(settings)
         url = acct_settings.url
+        pool_config = dict(acct_settings.pool_config, **pool_config)
     else:
         url = db_url
 
-    engine = create_engine(url, echo=echo)
-    return engine
+    poolclass = pool_config.get('poolclass')
+    if isinstance(poolclass, str):
+        try:
+            pool_config['poolclass'] = getattr(pool, poolclass)
+        except AttributeError:
+            msg = 'Unrecognized poolclass: {0}'.format(poolclass)
+            raise ValueError(msg)
 
+    return url, pool_config
 
-def init_session(db_url=None, echo=False, engine=None, settings=None):
+
+def init_session(db_url=None, echo=False, engine=None, settings=None, **pool_config):
     """
     A SQLAlchemy Session requires that an engine be initialized if one isn't
     provided.
     """
     if engine is None:
-        engine = init_engine(db_url=db_url, echo=echo, settings=settings)
+        engine = init_engine(db_url=db_url, echo=echo, settings=settings, **pool_config)
     return sessionmaker(bind=engine)
+
+
+def init_async_session(db_url=None, echo=False, engine=None, settings=None, **pool_config):
+    """
+    An AsyncSession factory, initializing an async engine if one isn't
+    provided.
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    if engine is None:
+        engine = init_async_engine(db_url=db_url, echo=echo, settings=settings, **pool_config)
+    return sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def init_replica_sessions(replica_urls=None, echo=False, settings=None, **pool_config):
+    """
+    Session factories of the read replicas of the database, one per
+    'Database URL' of replica_urls or, when replica_urls isn't passed, of
+    the YAML engine_config's replicas list.  Each replica is pooled the same
+    way as init_engine pools the primary.
+
+    :type replica_urls: list
+    :returns: a list of Session factories, empty when there are no replicas
+    """
+    return [init_session(engine=init_engine(db_url=url, echo=echo, **pool_config))
+            for url, pool_config in _replica_configs(replica_urls, settings, pool_config)]
+
+
+def init_async_replica_sessions(replica_urls=None, echo=False, settings=None, **pool_config):
+    """
+    The asyncio counterpart of init_replica_sessions, returning AsyncSession
+    factories
+    """
+    return [init_async_session(engine=init_async_engine(db_url=url, echo=echo, **pool_config))
+            for url, pool_config in _replica_configs(replica_urls, settings, pool_config)]
+
+
+def _replica_configs(replica_urls, settings, pool_config):
+    """
+    :returns: a list of (url, pool_config) tuples, one per replica
+    """
+    if replica_urls is None:
+        acct_settings = AccountStoreSettings(settings)
+        replica_urls = acct_settings.replica_urls
+        pool_config = dict(acct_settings.pool_config, **pool_config)
+    return [(url, dict(pool_config)) for url in replica_urls]
@@ -18,8 +18,8 @@ under the License.
 """
 
 """
-models.py features a basic, non-hierarchical, non-constrained RBAC data model,
-also known as a flat model
+models.py features a basic, non-constrained RBAC data model, also known as a
+flat model, which role_hierarchy optionally extends to a hierarchical model
 -- Ref:  http://csrc.nist.gov/rbac/sandhu-ferraiolo-kuhn-00.pdf
 
 +-----------------+          +-------------------+          +---------------+
@@ -41,7 +41,19 @@ also known as a flat model
 
 import itertools
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table, BigInteger
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Table,
+    event,
+    inspect,
+    select,
+)
 from sqlalchemy.orm import relationship
 
 from yosai_alchemystore import (
@@ -51,15 +63,79 @@ from yosai_alchemystore import (
 role_permission = Table(
     'role_permission', Base.metadata,
     Column('role_id', ForeignKey('role.pk_id'), primary_key=True),
-    Column('permission_id', ForeignKey('permission.pk_id'), primary_key=True)
+    Column('permission_id', ForeignKey('permission.pk_id'), primary_key=True),
+    Index('ix_role_permission_permission_id', 'permission_id', 'role_id')
 )
 
 role_membership = Table(
     'role_membership', Base.metadata,
     Column('role_id', ForeignKey('role.pk_id'), primary_key=True),
-    Column('user_id', ForeignKey('user.pk_id'), primary_key=True)
+    Column('user_id', ForeignKey('user.pk_id'), primary_key=True),
+    # the primary key leads with role_id, whereas lookups drive from the user
+    Index('ix_role_membership_user_id', 'user_id', 'role_id')
+)
+
+# role_hierarchy optionally arranges roles in a hierarchy:  a child role
+# inherits the permissions of its parent roles, and its members are members of
+# their parents.  role_closure is the transitive closure of role_hierarchy,
+# holding every (ancestor, descendant) pair of distinct roles so that a role's
+# ancestors are obtained through a single indexed join.  Both are maintained
+# by the AlchemyAccountStore's add_role_parent and remove_role_parent.
+role_hierarchy = Table(
+    'role_hierarchy', Base.metadata,
+    Column('parent_role_id', ForeignKey('role.pk_id'), primary_key=True),
+    Column('child_role_id', ForeignKey('role.pk_id'), primary_key=True)
+)
+
+role_closure = Table(
+    'role_closure', Base.metadata,
+    Column('ancestor_id', ForeignKey('role.pk_id'), primary_key=True),
+    Column('descendant_id', ForeignKey('role.pk_id'), primary_key=True),
+    Index('ix_role_closure_descendant_id', 'descendant_id', 'ancestor_id')
+)
+
+# user_effective_permission is a denormalization of the user -> role ->
+# permission graph, maintained by the AlchemyAccountStore when it is created
+# with effective_permissions=True
+user_effective_permission = Table(
+    'user_effective_permission', Base.metadata,
+    Column('user_id', ForeignKey('user.pk_id'), primary_key=True),
+    Column('permission_id', ForeignKey('permission.pk_id'), primary_key=True),
+    Index('ix_user_effective_permission_permission_id', 'permission_id', 'user_id')
 )
 
+# authz_version holds a single row whose version counts the changes made to
+# role memberships and role permissions, and user_authz_version stamps each
+# user with the version of the last change to its roles or permissions.  Both
+# are maintained by the AlchemyAccountStore when it is created with
+# track_versions=True.
+authz_version = Table(
+    'authz_version', Base.metadata,
+    Column('pk_id', Integer, primary_key=True),
+    Column('version', BigInteger, nullable=False)
+)
+
+user_authz_version = Table(
+    'user_authz_version', Base.metadata,
+    Column('user_id', ForeignKey('user.pk_id'), primary_key=True),
+    Column('version', BigInteger, nullable=False, index=True)
+)
+
+
+@event.listens_for(authz_version, 'after_create')
+def _insert_authz_version(target, connection, **kw):
+    insert_missing_authz_version(connection)
+
+
+def insert_missing_authz_version(connection):
+    """
+    Inserts the single authz_version counter row, unless it exists
+    """
+    exists = connection.execute(select([authz_version.c.pk_id]).
+                                where(authz_version.c.pk_id == 1)).first()
+    if exists is None:
+        connection.execute(authz_version.insert().values(pk_id=1, version=0))
+
 
 class User(Base):
     __tablename__ = 'user'
@@ -89,9 +165,9 @@ class Credential(Base):
     __tablename__ = 'credential'
 
     pk_id = Column(Integer, primary_key=True)
-    user_id = Column(ForeignKey('user.pk_id'), nullable=False, unique=False)
+    user_id = Column(ForeignKey('user.pk_id'), nullable=False, unique=False, index=True)
     credential = Column(String, nullable=False)
-    credential_type_id = Column(ForeignKey('credential_type.pk_id'), nullable=False)
+    credential_type_id = Column(ForeignKey('credential_type.pk_id'), nullable=False, index=True)
     expiration_dt = Column(DateTime(timezone=True), nullable=False)
 
     user = relationship('User',
@@ -104,6 +180,26 @@ class Credential(Base):
                 format(self.credential_type_id, self.user_id))
 
 
+class FailedAttempt(Base):
+    """
+    A failed authentication attempt, as recorded through the write-behind
+    FailedAttemptBuffer of an AlchemyAccountStore
+    """
+    __tablename__ = 'failed_attempt'
+
+    pk_id = Column(Integer, primary_key=True)
+    user_id = Column(ForeignKey('user.pk_id'), nullable=False)
+    credential_type_id = Column(ForeignKey('credential_type.pk_id'), nullable=False)
+    attempt_millis = Column(BigInteger, nullable=False)
+
+    # the recent attempts of a user are read through a range of this index
+    __table_args__ = (Index('ix_failed_attempt_user_id', 'user_id', 'attempt_millis'),)
+
+    def __repr__(self):
+        return ("FailedAttempt(user_id={0}, attempt_millis={1})".
+                format(self.user_id, self.attempt_millis))
+
+
 class CredentialType(Base):
     __tablename__ = 'credential_type'
 
@@ -148,9 +244,9 @@ class Permission(Base):
     __tablename__ = 'permission'
 
     pk_id = Column(Integer, primary_key=True)
-    domain_id = Column(ForeignKey('domain.pk_id'), nullable=True)
-    action_id = Column(ForeignKey('action.pk_id'), nullable=True)
-    resource_id = Column(ForeignKey('resource.pk_id'), nullable=True)
+    domain_id = Column(ForeignKey('domain.pk_id'), nullable=True, index=True)
+    action_id = Column(ForeignKey('action.pk_id'), nullable=True, index=True)
+    resource_id = Column(ForeignKey('resource.pk_id'), nullable=True, index=True)
 
     domain = relationship('Domain',
                           backref='permission')
@@ -182,3 +278,39 @@ class Role(Base):
 
     def __repr__(self):
         return "Role(title={0})".format(self.title)
+
+
+def create_missing_indexes(engine):
+    """
+    Upgrades a database created by an earlier version of these models,
+    creating the indexes that it lacks.  Existing indexes are left as is.
+
+    :returns: the names of the indexes created
+    """
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    return created
+
+
+def upgrade_schema(engine):
+    """
+    Upgrades a database created by an earlier version of these models:
+    creates the tables and indexes that it lacks and the authz_version
+    counter row, if missing.
+
+    :returns: the names of the indexes created
+    """
+    Base.metadata.create_all(engine)
+    created = create_missing_indexes(engine)
+    with engine.begin() as connection:
+        insert_missing_authz_version(connection)
+    return created
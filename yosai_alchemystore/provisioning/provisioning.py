@@ -0,0 +1,303 @@
+"""
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+"""
+provisioning.py bulk-loads accounts and role grants using SQLAlchemy Core
+executemany inserts in chunks, streaming rows from any iterable of dicts,
+such as those of read_csv and read_jsonl.
+
+Rows refer to one another by natural keys (user identifier, role title,
+credential type title and domain/action/resource names) rather than by
+primary keys, which are resolved a chunk at a time.
+"""
+import csv
+import datetime
+import itertools
+import json
+
+from sqlalchemy import select
+
+from yosai_alchemystore.models.models import (
+    Credential,
+    CredentialType,
+    User,
+    Domain,
+    Action,
+    Resource,
+    Permission,
+    Role,
+    role_membership as role_membership_table,
+    role_permission as role_permission_table,
+)
+
+
+def read_csv(path):
+    """
+    Streams the rows of a csv file that has a header line, as dicts.  Empty
+    values are read as None.
+    """
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield {key: value if value != '' else None
+                   for key, value in row.items()}
+
+
+def read_jsonl(path):
+    """
+    Streams the rows of a file of JSON objects, one per line, as dicts
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_rows(path):
+    """
+    Streams rows from a .csv or .jsonl file
+    """
+    if path.endswith('.csv'):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class BulkImporter:
+    """
+    BulkImporter loads users, credentials, roles, role memberships and
+    role-permission grants.  Each import_* method consumes an iterable of
+    dicts, commits one transaction per chunk and returns the number of rows
+    inserted.
+
+    Role memberships and grants bypass the AlchemyAccountStore, so a store
+    that uses effective_permissions must refresh_effective_permissions
+    afterwards.
+    """
+
+    # the maximum number of values bound to a single IN clause when looking
+    # up the existing rows of a chunk (sqlite: 999 bind parameters)
+    lookup_chunk_size = 500
+
+    def __init__(self, engine, chunk_size=10000):
+        """
+        :param engine: a SQLAlchemy Engine, such as obtained from init_engine
+        :param chunk_size: the number of rows inserted per executemany, which
+                           doesn't bound the IN clauses of the lookups
+        """
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self._names = {}  # (table, name): pk_id of the small lookup tables
+        self._permissions = None  # (domain_id, action_id, resource_id): pk_id
+
+    def _insert(self, table, rows, prepare):
+        """
+        Inserts rows a chunk at a time, each chunk in its own transaction
+        using a single executemany
+
+        :param prepare: a callable of (connection, chunk) that returns the
+                        chunk's insert parameters
+        """
+        count = 0
+        for batch in _batches(rows, self.chunk_size):
+            try:
+                with self.engine.begin() as conn:
+                    params = prepare(conn, batch)
+                    if params:
+                        conn.execute(table.insert(), params)
+            except Exception:
+                # the pk_ids cached by the chunk may have been rolled back
+                self._names = {}
+                self._permissions = None
+                raise
+            count += len(params)
+        return count
+
+    def _select_in(self, conn, columns, column, values):
+        """
+        :returns: the rows of the columns where column is one of values, as
+                  selected with IN clauses of at most lookup_chunk_size values
+        """
+        rows = []
+        for batch in _batches(set(values), self.lookup_chunk_size):
+            rows.extend(conn.execute(select(columns).where(column.in_(batch))))
+        return rows
+
+    def _user_ids(self, conn, identifiers):
+        """
+        :returns: a dict of identifier to user pk_id for one chunk
+        """
+        return dict(self._select_in(conn, [User.identifier, User.pk_id],
+                                    User.identifier, identifiers))
+
+    def _name_id(self, conn, model, column, name):
+        """
+        Finds or creates the row of a small lookup table (role, credential
+        type, domain, action or resource) by name, caching its pk_id
+        """
+        if name is None:
+            return None
+
+        key = (model.__tablename__, name)
+        try:
+            return self._names[key]
+        except KeyError:
+            pass
+
+        pk_id = conn.execute(select([model.pk_id]).where(column == name)).scalar()
+        if pk_id is None:
+            result = conn.execute(model.__table__.insert(), {column.key: name})
+            pk_id = result.inserted_primary_key[0]
+        self._names[key] = pk_id
+        return pk_id
+
+    def _permission_id(self, conn, domain, action, resource):
+        """
+        Finds or creates the Permission of (domain, action, resource) names,
+        a None name being a wildcard
+        """
+        if self._permissions is None:
+            query = select([Permission.domain_id, Permission.action_id,
+                            Permission.resource_id, Permission.pk_id])
+            self._permissions = {tuple(row[:3]): row[3]
+                                 for row in conn.execute(query)}
+
+        key = (self._name_id(conn, Domain, Domain.name, domain),
+               self._name_id(conn, Action, Action.name, action),
+               self._name_id(conn, Resource, Resource.name, resource))
+        try:
+            return self._permissions[key]
+        except KeyError:
+            result = conn.execute(Permission.__table__.insert(),
+                                  dict(domain_id=key[0], action_id=key[1], resource_id=key[2]))
+            pk_id = self._permissions[key] = result.inserted_primary_key[0]
+            return pk_id
+
+    def import_users(self, rows):
+        """
+        :param rows: dicts of identifier, first_name, last_name and,
+                     optionally, phone_number and account_lock_millis
+        """
+        def prepare(conn, batch):
+            return [dict(identifier=row['identifier'],
+                         first_name=row['first_name'],
+                         last_name=row['last_name'],
+                         phone_number=row.get('phone_number'),
+                         account_lock_millis=_int(row.get('account_lock_millis')))
+                    for row in batch]
+
+        return self._insert(User.__table__, rows, prepare)
+
+    def import_roles(self, rows):
+        """
+        :param rows: dicts of title.  Existing roles are skipped.
+        """
+        def prepare(conn, batch):
+            existing = {title for title, in self._select_in(
+                conn, [Role.title], Role.title, (row['title'] for row in batch))}
+            return [{'title': title}
+                    for title in _unique(row['title'] for row in batch)
+                    if title not in existing]
+
+        return self._insert(Role.__table__, rows, prepare)
+
+    def import_credentials(self, rows):
+        """
+        :param rows: dicts of identifier, credential_type (title), credential
+                     and expiration_dt (a datetime or an ISO 8601 string).
+                     Rows of unknown identifiers are skipped.
+        """
+        def prepare(conn, batch):
+            user_ids = self._user_ids(conn, (row['identifier'] for row in batch))
+            return [dict(user_id=user_ids[row['identifier']],
+                         credential_type_id=self._name_id(conn, CredentialType,
+                                                          CredentialType.title,
+                                                          row['credential_type']),
+                         credential=row['credential'],
+                         expiration_dt=_datetime(row['expiration_dt']))
+                    for row in batch if row['identifier'] in user_ids]
+
+        return self._insert(Credential.__table__, rows, prepare)
+
+    def import_role_memberships(self, rows):
+        """
+        :param rows: dicts of identifier and role (title).  Rows of unknown
+                     identifiers and existing memberships are skipped.
+        """
+        rm = role_membership_table
+
+        def prepare(conn, batch):
+            user_ids = self._user_ids(conn, (row['identifier'] for row in batch))
+            existing = {tuple(row) for row in self._select_in(
+                conn, [rm.c.user_id, rm.c.role_id], rm.c.user_id, user_ids.values())}
+            members = ((user_ids[row['identifier']],
+                        self._name_id(conn, Role, Role.title, row['role']))
+                       for row in batch if row['identifier'] in user_ids)
+            return [dict(user_id=user_id, role_id=role_id)
+                    for user_id, role_id in _unique(members)
+                    if (user_id, role_id) not in existing]
+
+        return self._insert(rm, rows, prepare)
+
+    def import_role_permissions(self, rows):
+        """
+        :param rows: dicts of role (title), and domain, action and resource
+                     names, any of which may be None (a wildcard).  Existing
+                     grants are skipped.
+        """
+        rp = role_permission_table
+
+        def prepare(conn, batch):
+            grants = [(self._name_id(conn, Role, Role.title, row['role']),
+                       self._permission_id(conn, row.get('domain'),
+                                           row.get('action'), row.get('resource')))
+                      for row in batch]
+            existing = {tuple(row) for row in self._select_in(
+                conn, [rp.c.role_id, rp.c.permission_id], rp.c.role_id,
+                (role_id for role_id, _ in grants))}
+            return [dict(role_id=role_id, permission_id=permission_id)
+                    for role_id, permission_id in _unique(grants)
+                    if (role_id, permission_id) not in existing]
+
+        return self._insert(rp, rows, prepare)
+
+
+def _unique(values):
+    seen = set()
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            yield value
+
+
+def _int(value):
+    return int(value) if value is not None else None
+
+
+def _datetime(value):
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value